@@ -306,7 +306,7 @@ def get_frederiksberg_analysis():
             ]),
 
             _datakilde_box([
-                html.Li([html.B("Fil: "), "Skolen p\u00e5 duevej vedligeholdelsesplan.xlsx"]),
+                html.Li([html.B("Fil: "), "<bygning> vedligeholdelsesplan.xlsx (\u00e9n pr. bygning, f.eks. Skolen p\u00e5 duevej)"]),
                 html.Li([html.B("Ark: "), "Hovedark (header r\u00e6kke 0, r\u00e6kke 2 springes over)"]),
                 html.Li([html.B("Kolonner brugt: "), "Hovedomkostningsomr\u00e5de (kategori/farveopdeling), Tilstand (tilstandsgrad 1\u20134), \u00e5rskolonner 2023\u20132033 (budget i DKK)"]),
                 html.Li([html.B("Beregning: "), "Hver r\u00e6kke repr\u00e6senterer en vedligeholdelsespost. Kumulativ linje beregnes som l\u00f8bende sum af \u00e5rlige totaler."]),
@@ -341,7 +341,7 @@ def get_frederiksberg_analysis():
             ]),
 
             _datakilde_box([
-                html.Li([html.B("Fil: "), "Forbedringer energimærker skolen p\u00e5 duevej.xlsx"]),
+                html.Li([html.B("Fil: "), "Forbedringer energimærker <bygning>.xlsx (\u00e9n pr. bygning)"]),
                 html.Li([html.B("Ark: "), "Forbedringer (header p\u00e5 r\u00e6kke 2)"]),
                 html.Li([html.B("Kolonner brugt: "), "Investering (DKK, X-akse), Besparelse (CO2 tons/\u00e5r, Y-akse), TBT (tilbagebetalingstid), Type (farvekategori), Titel + Bygninger (hover-label)"]),
                 html.Li([html.B("Beregning: "), "Median-linjer beregnes for b\u00e5de DKK og CO2 som referencelinjer. Trendlinje via line\u00e6r regression."]),
@@ -380,7 +380,7 @@ def get_frederiksberg_analysis():
             ]),
 
             _datakilde_box([
-                html.Li([html.B("Fil: "), "Oplysninger bygninger skolen p\u00e5 duevej.xlsx"]),
+                html.Li([html.B("Fil: "), "Oplysninger bygninger <bygning>.xlsx (\u00e9n pr. bygning)"]),
                 html.Li([html.B("Ark 1: "), "Bygninger (header p\u00e5 r\u00e6kke 2) \u2014 indeholder Bygningsnavn, Opvarmet areal (m\u00b2), Opf\u00f8relses\u00e5r og Energimærke."]),
                 html.Li([html.B("Ark 2: "), "Teoretisk forbrug (header p\u00e5 r\u00e6kke 2) \u2014 indeholder Ejendomsnavn og Besparelse % (kWh)."]),
                 html.Li([html.B("Kombinering: "), "De to ark sammenkobles (merge) via Bygningsnavn \u2194 Ejendomsnavn. Resultatet giver besparelsesprocent koblet med bygningskarakteristika for alle matchede bygninger."]),
@@ -416,7 +416,7 @@ def get_frederiksberg_analysis():
             ]),
 
             _datakilde_box([
-                html.Li([html.B("Fil: "), "Skolen p\u00e5 duevej vedligeholdelsesplan.xlsx (samme fil som Dashboard 1)"]),
+                html.Li([html.B("Fil: "), "<bygning> vedligeholdelsesplan.xlsx (samme filer som Dashboard 1)"]),
                 html.Li([html.B("Kolonner brugt: "), "Tilstand (tilstandsgrad, Y-akse), \u00e5rskolonner 2023\u20132033 (budget i DKK, cellefarve)"]),
                 html.Li([html.B("Beregning: "), "Samme vedligeholdelsesdata pivoteres: r\u00e6kker grupperes efter Tilstandsgrad, kolonner er \u00e5rstal, og cellev\u00e6rdier er summeret budget (DKK). Dette giver en anden vinkel p\u00e5 det samme datas\u00e6t."]),
             ])
@@ -454,7 +454,7 @@ def get_frederiksberg_analysis():
             ]),
 
             _datakilde_box([
-                html.Li([html.B("Fil: "), "Forbedringer energimærker skolen p\u00e5 duevej.xlsx (samme fil som Dashboard 2)"]),
+                html.Li([html.B("Fil: "), "Forbedringer energimærker <bygning>.xlsx (samme filer som Dashboard 2)"]),
                 html.Li([html.B("Ark: "), "Forbedringer"]),
                 html.Li([html.B("Kolonner brugt: "), "TBT (tilbagebetalingstid i \u00e5r, X-akse), Besparelse (CO2 tons/\u00e5r, Y-akse), Investering (DKK, boblest\u00f8rrelse), Type (farvekategori)"]),
                 html.Li([html.B("Beregning: "), "Samme projektdata som Dashboard 2, men visualiseret med TBT p\u00e5 X-aksen i stedet for DKK. Quick Wins-zonen markerer projekter med TBT \u2264 10 \u00e5r og CO2 over gennemsnittet."]),
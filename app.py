@@ -1,11 +1,18 @@
+import os
+import uuid
 import dash
-from dash import dcc, html, Input, Output, State, clientside_callback
+from flask import Response, abort, request
+from dash import dcc, html, Input, Output, State, ALL, MATCH, ClientsideFunction, clientside_callback
+import plotly.io as pio
 from plots import *
-from data_processing import rearrange_carbon_data
 from data_processing_fbr import *
 from plots_fbr import *
 from analysis_generator import *
 from data_processing_randers import *
+from sync_jobs import submit_sync, get_job, cancel_job
+from figure_cache import cached_figure, cached_page, prefetch_figures, FigureTimeout
+from figure_payload import expand_strings
+from data_store import get_store, start_warm_up
 
 
 # Use high-reliability CDN links
@@ -21,7 +28,8 @@ app = dash.Dash(
     __name__,
     external_scripts=external_scripts,
     external_stylesheets=external_stylesheets,
-    suppress_callback_exceptions=True
+    suppress_callback_exceptions=True,
+    compress=True  # Brotli/gzip responses via flask-compress
 )
 
 # Simplified index string - no inline JS to crash the renderer
@@ -108,9 +116,23 @@ def create_sidebar():
     )
 
 
+# Plotly templates for the two themes. The figures are built in the light one;
+# assets/theme.js swaps in the dark one on the graphs already on the page.
+PLOTLY_TEMPLATES = {
+    "light": pio.templates["plotly_white"].to_plotly_json(),
+    "dark": pio.templates["plotly_dark"].to_plotly_json(),
+}
+
+
 # --- UPDATED APP LAYOUT ---
 app.layout = html.Div(className="flex min-h-screen", children=[
     dcc.Location(id="url", refresh=False), # CRITICAL: This was missing
+    # Background sync: job id of the running sync, polled while it runs
+    dcc.Store(id="sync-job"),
+    dcc.Interval(id="sync-poll", interval=1000, disabled=True),
+    # Theme: switched in the browser (assets/theme.js), never by a server callback
+    dcc.Store(id="theme", data="light"),
+    dcc.Store(id="plotly-templates", data=PLOTLY_TEMPLATES),
     create_sidebar(),
     
     # --- UPDATED HEADER IN APP.LAYOUT ---
@@ -132,9 +154,11 @@ app.layout = html.Div(className="flex min-h-screen", children=[
                 html.Button("Eksportér PDF", id="btn-pdf", className="px-4 py-2 bg-white dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded-lg text-sm font-medium shadow-sm hover:bg-slate-50 transition-colors"),
 
                 
-                html.Button("Opdater Data (Sync JSON)", id="sync-button", className="px-4 py-2 bg-blue-500 text-white rounded")
+                html.Button("Opdater Data (Sync JSON)", id="sync-button", className="px-4 py-2 bg-blue-500 text-white rounded"),
+                html.Button("Annuller", id="sync-cancel", className="px-4 py-2 bg-white dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded-lg text-sm font-medium shadow-sm hover:bg-slate-50 transition-colors", style={"display": "none"})
             ])
         ]),
+        html.Div(id="sync-status", className="-mt-6 mb-6 text-right text-sm text-slate-500 dark:text-slate-400"),
         
         # Grid for Dashboards
         html.Div(id="dashboard-content", className="flex flex-col gap-8 w-full pb-20"),
@@ -182,15 +206,203 @@ def make_card(title, desc, kpi1_label, kpi1_val, kpi2_label, kpi2_val, plot=None
         ])
     ])
 
+# --- LAZY CARD PLOTS ---
+# The page callback returns the cards with a skeleton in place of each plot. A card's
+# plot is built by load_card_plot once the card scrolls into view (assets/lazy_cards.js),
+# in a request of its own, so the cards fill in concurrently as each one finishes.
+def lazy_plot(key):
+    return html.Div(className="h-full", children=[
+        dcc.Store(id={'type': 'card-visible', 'index': key}),
+        html.Div(
+            id={'type': 'lazy-card', 'index': key},
+            className="h-full",
+            # A new token per render, so a card re-rendered in place is loaded again
+            **{"data-lazy-card": key, "data-lazy-token": uuid.uuid4().hex},
+            children=html.Div("Data indlæses...", className="flex items-center justify-center h-full text-slate-400 animate-pulse")
+        )
+    ])
+
+
+def randers_roi_plot(filters):
+    return dcc.Graph(
+        id={'type': 'dynamic-graph', 'index': 1},
+        figure=cached_figure("randers", create_roi_matrix, "randers"),
+        config={'displayModeBar': True, 'scrollZoom': True, 'responsive': True},
+        style={'height': '100%', 'width': '100%'}
+    )
+
+
+def randers_characteristics_plot(filters):
+    return dcc.Graph(
+        id={'type': 'dynamic-graph', 'index': 2},
+        figure=cached_figure("randers", create_building_characteristics, "randers"),
+        config={'displayModeBar': True, 'scrollZoom': True, 'responsive': True},
+        style={'height': '100%', 'width': '100%'}
+    )
+
+
+def randers_map_plot(filters):
+    # The map is a static page served by map_page; the version in the URL makes the iframe reload after a Sync
+    return html.Iframe(
+        id="randers-ventilation-map",
+        src=f"/kort/randers?v={get_store().version('randers')[:12]}",
+        style={
+            "width": "100%", 
+            "height": "500px", # Matches the height of your other graphs
+            "border": "none",
+            "border-radius": "8px"
+        }
+    )
+
+
+def faaborg_energy_plot(filters):
+    fig2_bar, fig2_detail = cached_figure("faaborg", create_faaborg_energy_performance, "faaborg")
+
+    # Cached figures are plain, compacted figure dicts
+    building_list = []
+    if fig2_bar and fig2_bar.get('data') and len(fig2_bar['data'][0].get('y', [])) > 0:
+        building_list = expand_strings(fig2_bar['data'][0]['y'])
+
+    if not building_list:
+        return html.Div("Ingen data fundet i 'Beregnede forbrug Domutech' arket.", className="p-10 text-red-500")
+
+    return html.Div([
+        # Dropdown
+        html.Div(className="mb-4", children=[
+            html.Label("Vælg Adresse:", className="text-xs font-bold text-gray-500 mb-2 block"),
+            dcc.Dropdown(
+                id="address-selector",
+                options=[{"label": str(addr), "value": str(addr)} for addr in building_list],
+                value=building_list[0] if building_list else None,
+                className="w-full"
+            ),
+        ]),
+
+        # Split View
+        html.Div(className="flex flex-col lg:flex-row gap-4", children=[
+            # LEFT SIDE: The Scrollable Container
+            html.Div(
+                style={
+                    'flex': '1', 
+                    'height': '650px', 
+                    'overflow-y': 'auto', # Changed to auto for better scrollbar behavior
+                    'border': '1px solid #e2e8f0', 
+                    'border-radius': '8px',
+                    'padding': '0px', # Ensure no internal padding shifts the chart
+                    'display': 'block'
+                }, 
+                children=[
+                    dcc.Graph(
+                        id="db2-bar-chart", 
+                        figure=fig2_bar, 
+                        config={'displayModeBar': False},
+                        # Remove any default style padding/margin from the Graph object itself
+                        style={'margin': '0', 'padding': '0'} 
+                    )
+                ]
+            ),
+            
+            # RIGHT SIDE: Fixed Breakdown
+            html.Div(
+                style={
+                    'flex': '1', 
+                    'height': '600px', 
+                    'border': '1px solid #e2e8f0', 
+                    'border-radius': '8px'
+                }, 
+                children=[
+                    dcc.Graph(id="db2-trend-graph", figure=fig2_detail)
+                ]
+            )
+        ])
+    ])
+
+
+def faaborg_procurement_plot(filters):
+    return dcc.Graph(figure=cached_figure("faaborg", create_faaborg_procurement_gap, "faaborg"), style={'height': '500px'})
+
+
+def faaborg_ventilation_plot(filters):
+    return dcc.Graph(figure=cached_figure("faaborg", create_faaborg_ventilation_peaks, "faaborg"), style={'height': '500px'})
+
+
+FRB_FIGURE_BUILDERS = [
+    create_frb_maintenance_budget,
+    create_frb_project_scatter,
+    create_frb_property_characteristics,
+    create_frb_risk_heatmap,
+    create_frb_roi_chart,
+]
+
+
+def frb_figure(index, selected_buildings):
+    """Frederiksberg figure number index for the selected building keys (all buildings if none)."""
+    buildings = tuple(sorted(selected_buildings or ()))
+    return cached_figure("frederiksberg", FRB_FIGURE_BUILDERS[index], buildings=buildings)
+
+
+def frb_plot(index):
+    def build(filters):
+        # Built for the buildings selected when the card comes into view
+        return dcc.Graph(id={'type': 'frb-graph', 'index': index}, figure=frb_figure(index, filters.get("frb-buildings")))
+    return build
+
+
+# The figures behind each municipality's cards (with the arguments the card plots
+# use), started together in the figure pool when the page is rendered. The card
+# requests then pick up the builds already running or done.
+PAGE_FIGURES = {
+    "randers": [
+        (create_roi_matrix, ("randers",), {}),
+        (create_building_characteristics, ("randers",), {}),
+    ],
+    "faaborg": [
+        (create_faaborg_energy_performance, ("faaborg",), {}),
+        (create_faaborg_procurement_gap, ("faaborg",), {}),
+        (create_faaborg_ventilation_peaks, ("faaborg",), {}),
+    ],
+    "frederiksberg": [(builder, (), {"buildings": ()}) for builder in FRB_FIGURE_BUILDERS],
+}
+
+
+CARD_PLOTS = {
+    "randers-roi": randers_roi_plot,
+    "randers-characteristics": randers_characteristics_plot,
+    "randers-map": randers_map_plot,
+    "faaborg-energy": faaborg_energy_plot,
+    "faaborg-procurement": faaborg_procurement_plot,
+    "faaborg-ventilation": faaborg_ventilation_plot,
+    **{f"frb-{i}": frb_plot(i) for i in range(len(FRB_FIGURE_BUILDERS))},
+}
+
+
+@app.callback(
+    Output({'type': 'lazy-card', 'index': MATCH}, 'children'),
+    Input({'type': 'card-visible', 'index': MATCH}, 'data'),
+    State({'type': 'card-filter', 'index': ALL}, 'value'),
+    prevent_initial_call=True
+)
+def load_card_plot(_, filter_values):
+    key = dash.ctx.outputs_list["id"]["index"]
+    filters = {state["id"]["index"]: state.get("value") for state in dash.ctx.states_list[0]}
+    try:
+        return CARD_PLOTS[key](filters)
+    except FigureTimeout as e:
+        print(f"Card {key} not loaded: {e}")
+        return html.Div("Figuren er ikke klar endnu - genindlæs siden om lidt.", className="flex items-center justify-center h-full text-slate-400")
+    except Exception as e:
+        print(f"Card {key} not loaded: {e}")
+        return html.Div("Data kunne ikke indlæses.", className="flex items-center justify-center h-full text-red-500")
+
+
 # --- DANISH CALLBACK ---
 @app.callback(
     [Output("muni-header", "children"), 
      Output("dashboard-content", "children")],
     [Input("url", "pathname"), 
-     Input("muni-selector", "value"),
-     Input("dummy-output", "children")]
+     Input("muni-selector", "value")]
 )
-def update_dynamic_content(pathname, muni_value, theme_trigger):
+def update_dynamic_content(pathname, muni_value):
     # Standard header formatting
     header_text = f"{muni_value.replace('-', ' ')} KOMMUNE".upper()
     
@@ -206,38 +418,26 @@ def update_dynamic_content(pathname, muni_value, theme_trigger):
             return header_text, html.Div("Forklaring for denne kommune er under udarbejdelse...", className="p-10 text-slate-500 text-center")
 
 
+    # The cards are returned right away; their plots are loaded per card (see load_card_plot),
+    # from figures that start building now
+    prefetch_figures(muni_value, PAGE_FIGURES.get(muni_value, []))
+
     # --- MODE 1: RANDERS ---
     if muni_value == "randers":
-        # Generate Randers specific figures
-        fig_roi = create_roi_matrix(muni_value)
-        fig_char = create_building_characteristics(muni_value)
-
-        map_html = create_randers_map()
-
         return header_text, [
             make_card(
                 "ROI Matrix: Strategisk Prioritering",
                 "Denne matrix prioriterer energiprojekter baseret på forholdet mellem CO2-besparelse og investeringsomkostning. Brug scatter-plottet til at identificere de projekter, der giver størst klimaeffekt pr. investeret krone — scroll for at zoome i data.",
                 "KOMMUNE", "RANDERS", 
                 "STATUS", "VERIFICERET", 
-                plot=dcc.Graph(
-                    id={'type': 'dynamic-graph', 'index': 1},
-                    figure=fig_roi, 
-                    config={'displayModeBar': True, 'scrollZoom': True, 'responsive': True},
-                    style={'height': '100%', 'width': '100%'}
-                )
+                plot=lazy_plot("randers-roi")
             ),
             make_card(
                 "Bygningsmasse: Karakteristika",
                 "Oversigt over kommunens ejendomsportefølje fordelt på opførelsesår og energimærkeklasse. Diagrammet afslører mønstre i bygningsstanden og hjælper med at målrette renoveringsindsatsen mod de mest energitunge segmenter.",
                 "BYGNINGER", "TOTAL OVERSIGT", 
                 "ANALYSE", "KLAR", 
-                plot=dcc.Graph(
-                    id={'type': 'dynamic-graph', 'index': 2},
-                    figure=fig_char, 
-                    config={'displayModeBar': True, 'scrollZoom': True, 'responsive': True},
-                    style={'height': '100%', 'width': '100%'}
-                )
+                plot=lazy_plot("randers-characteristics")
             ),
 
             make_card(
@@ -245,146 +445,76 @@ def update_dynamic_content(pathname, muni_value, theme_trigger):
                 "Geografisk overblik over ventilationsanlæg med kritiske fejl og vedligeholdelsesbehov baseret på Timesafe-data. Kortet gør det muligt hurtigt at lokalisere problemområder og planlægge service-indsatsen effektivt.",
                 "KILDE", "TIMESAFE", 
                 "REGION", "RANDERS", 
-                plot=html.Iframe(
-                    id="randers-ventilation-map",
-                    srcDoc=map_html,
-                    style={
-                        "width": "100%", 
-                        "height": "500px", # Matches the height of your other graphs
-                        "border": "none",
-                        "border-radius": "8px"
-                    }
-                )
+                plot=lazy_plot("randers-map")
             )
             
         ]
 
     # --- MODE 2: FAABORG-MIDTFYN ---
     elif muni_value == "faaborg":
-        
-        res2 = create_faaborg_energy_performance(muni_value)
-        fig2_bar, fig2_detail = res2
-
-        fig5 = create_faaborg_procurement_gap(muni_value)
-        fig6 = create_faaborg_ventilation_peaks(muni_value)
-
-        building_list = []
-        if fig2_bar and hasattr(fig2_bar, 'data') and len(fig2_bar.data) > 0:
-            building_list = list(fig2_bar.data[0].y)
-
-        # 3. Build UI
-        if not building_list:
-            db2_display = html.Div("Ingen data fundet i 'Beregnede forbrug Domutech' arket.", className="p-10 text-red-500")
-        else:
-            db2_display = html.Div([
-                # Dropdown
-                html.Div(className="mb-4", children=[
-                    html.Label("Vælg Adresse:", className="text-xs font-bold text-gray-500 mb-2 block"),
-                    dcc.Dropdown(
-                        id="address-selector",
-                        options=[{"label": str(addr), "value": str(addr)} for addr in building_list],
-                        value=building_list[0] if building_list else None,
-                        className="w-full"
-                    ),
-                ]),
-
-                # Split View
-                html.Div(className="flex flex-col lg:flex-row gap-4", children=[
-                    # LEFT SIDE: The Scrollable Container
-                    html.Div(
-                        style={
-                            'flex': '1', 
-                            'height': '650px', 
-                            'overflow-y': 'auto', # Changed to auto for better scrollbar behavior
-                            'border': '1px solid #e2e8f0', 
-                            'border-radius': '8px',
-                            'padding': '0px', # Ensure no internal padding shifts the chart
-                            'display': 'block'
-                        }, 
-                        children=[
-                            dcc.Graph(
-                                id="db2-bar-chart", 
-                                figure=fig2_bar, 
-                                config={'displayModeBar': False},
-                                # Remove any default style padding/margin from the Graph object itself
-                                style={'margin': '0', 'padding': '0'} 
-                            )
-                        ]
-                    ),
-                    
-                    # RIGHT SIDE: Fixed Breakdown
-                    html.Div(
-                        style={
-                            'flex': '1', 
-                            'height': '600px', 
-                            'border': '1px solid #e2e8f0', 
-                            'border-radius': '8px'
-                        }, 
-                        children=[
-                            dcc.Graph(id="db2-trend-graph", figure=fig2_detail)
-                        ]
-                    )
-                ])
-            ])
-
-
         return header_text, [
             make_card(
                 "Forbrug & Bæredygtighed",
                 "Sammenligner faktisk energiforbrug med det forventede forbrug ifølge bygningernes energimærker. Det røde område synliggør de 'skjulte omkostninger', hvor bygninger bruger markant mere energi end deres mærkning indikerer.",
                 "ADRESSER", "170+", 
                 "STATUS", "KLAR", 
-                plot=db2_display # PASS THE COMBINED DIV HERE
+                plot=lazy_plot("faaborg-energy")
             ),
             make_card(
                 "Indkøb & Prisfølsomhed",
                 "Visualiserer besparelsespotentialet ved at samle vedligeholdelsesopgaver i fællesindkøb fremfor enkeltordrer. Sammenligningen af Pris 1 og Pris 3 viser, hvor meget kommunen kan spare ved en koordineret indkøbsstrategi.",
                 "POTENTIALE", "HØJT", "STRATEGI", "INDLYSENDE",
-                plot=dcc.Graph(figure=fig5, style={'height': '500px'})
+                plot=lazy_plot("faaborg-procurement")
             ),
             make_card(
                 "Vedligeholdelses-Peak (Sæson)",
                 "Histogram over hvornår filterskift udføres på tværs af 60+ lokationer i løbet af året. Indsigten bruges til at udjævne arbejdsbyrden og undgå sæsonbestemte flaskehalse i driftsteamet.",
                 "PEAK MÅNED", "JANUAR", "ENHEDER", "50+",
-                plot=dcc.Graph(figure=fig6, style={'height': '500px'})
+                plot=lazy_plot("faaborg-ventilation")
             )
         ]
     # --- Frederiksberg --- 
     elif muni_value == "frederiksberg":
-        # Load mapping locally within the function to avoid NameError
-        with open('mapping.json', 'r', encoding='utf-8') as f:
-            mapping = json.load(f)
-            
-        muni_cfg = mapping.get("frederiksberg")
-        folder = muni_cfg["folder"]
-        files = muni_cfg["files"]
+        buildings = get_store().get("frederiksberg", "buildings")
 
         return header_text, [
+            # Building filter - empty means the whole portfolio
+            html.Div(className="bg-white dark:bg-slate-800 rounded-xl shadow-md border border-slate-200 dark:border-slate-700 p-6 w-full", children=[
+                html.Label("Vælg bygninger:", className="text-xs font-bold text-gray-500 mb-2 block"),
+                dcc.Dropdown(
+                    id={'type': 'card-filter', 'index': 'frb-buildings'},
+                    options=[{"label": name, "value": key} for key, name in buildings.items()],
+                    value=[],
+                    multi=True,
+                    placeholder=f"Alle bygninger ({len(buildings)})",
+                    className="w-full"
+                ),
+            ]),
             #html.Div(className="grid grid-cols-1 md:grid-cols-2 gap-6", children=[
                 make_card(
                     "Vedligeholdelsesplan", "Oversigt over det 10-årige vedligeholdelsesbudget baseret på Dalux-data. Planen fordeler investeringsbehovet over tid og synliggør, hvornår de største udgiftsposter falder.",
                     "TYPE", "DALUX", "PRIORITET", "HØJ", # Added missing 2
-                    plot=dcc.Graph(figure=create_frb_maintenance_budget())
+                    plot=lazy_plot("frb-0")
                 ),
                 make_card(
                     "Potentiale", "Scatter-plot der viser forholdet mellem investeringsomkostning (DKK) og CO2-reduktion for hvert potentielt projekt. Bruges til at identificere de mest omkostningseffektive klimaindsatser i porteføljen.",
                     "UNIT", "TONS", "STATUS", "ANALYSERET", # Added missing 2
-                    plot=dcc.Graph(figure=create_frb_project_scatter())
+                    plot=lazy_plot("frb-1")
                 ),
                 make_card(
                     "Portefølje Analyse", "Analyse af kommunens bygningsportefølje med energimærkeklasse plottet mod byggeår. Visualiseringen afslører sammenhængen mellem bygningsalder og energiperformance og peger på renoveringspotentialet.",
                     "KILDE", "ESG", "BYGNINGER", "ALLE", # Added missing 2
-                    plot=dcc.Graph(figure=create_frb_property_characteristics())
+                    plot=lazy_plot("frb-2")
                 ),
                 make_card(
                     "Risiko Heatmap", "Heatmap der krydser bygningernes fysiske tilstand med deres vedligeholdelsesomkostninger. Gør det muligt at prioritere indsatsen mod bygninger med høj risiko — dårlig tilstand kombineret med stigende omkostninger.",
                     "LEVEL", "GRAD 1 (GOD) - 5 (Kritisk)", "RISIKO", "SYNLIG", # Added missing 2
-                    plot=dcc.Graph(figure=create_frb_risk_heatmap())
+                    plot=lazy_plot("frb-3")
                 ),
                 make_card(
                     "ROI Bubble", "Bubble-diagram der visualiserer investeringens størrelse mod tilbagebetalingstiden (TBT) for hvert projekt. Større bobler indikerer højere investeringsbeløb, og placeringen afslører hvilke projekter der hurtigst tjener sig hjem.",
                     "FOCUS", "ROI", "OPTIMAL", "JA", # Added missing 2
-                    plot=dcc.Graph(figure=create_frb_roi_chart())
+                    plot=lazy_plot("frb-4")
                 )
                 
             #])
@@ -422,64 +552,155 @@ def update_trend_on_selection(selected_address, muni):
     if not selected_address or muni != "faaborg":
         return go.Figure()
     
-    # We call the function again, but this time we pass the 'selected_address'
-    # The '_' ignores the bar chart (since we don't need to re-render that)
-    _, fig_trend = create_faaborg_energy_performance(muni, selected_address=selected_address)
-    
-    return fig_trend
+    # Only the detail chart is rebuilt, from the precomputed per-address trend table
+    return create_faaborg_trend(muni, selected_address)
+
+
 
+@app.callback(
+    Output({'type': 'frb-graph', 'index': ALL}, 'figure'),
+    Input({'type': 'card-filter', 'index': 'frb-buildings'}, 'value'),
+    prevent_initial_call=True
+)
+def update_frb_building_filter(selected_buildings):
+    # Only the cards already loaded are updated; the others are built for the selection when they load
+    indices = [output["id"]["index"] for output in dash.ctx.outputs_list]
+    buildings = tuple(sorted(selected_buildings or ()))
+    prefetch_figures("frederiksberg", [(FRB_FIGURE_BUILDERS[i], (), {"buildings": buildings}) for i in indices])
+    figures = []
+    for i in indices:
+        try:
+            figures.append(frb_figure(i, selected_buildings))
+        except FigureTimeout as e:
+            print(f"Frederiksberg figure {i} not updated: {e}")
+            figures.append(dash.no_update)
+        except Exception as e:
+            print(f"Frederiksberg figure {i} not built: {e}")
+            figures.append(go.Figure().add_annotation(text="Data kunne ikke indlæses.", showarrow=False))
+    return figures
 
 
 @app.callback(
-    Output("sync-button", "children"),
+    [Output("sync-job", "data"),
+     Output("sync-poll", "disabled"),
+     Output("sync-status", "children", allow_duplicate=True)],
     Input("sync-button", "n_clicks"),
     State("muni-selector", "value"), # We need to know which muni is active
     prevent_initial_call=True
 )
 def sync_data(n_clicks, selected_muni):
     if not selected_muni:
-        return "Vælg kommune først! ⚠️"
+        return dash.no_update, True, "Vælg kommune først! ⚠️"
 
-    # Load mapping to get paths
-    with open('mapping.json', 'r', encoding='utf-8') as f:
-        mapping = json.load(f)
+    # The ETL runs in the background (see sync_jobs.py), this only starts it
+    job_id, created = submit_sync(selected_muni)
+    if not created:
+        return job_id or dash.no_update, False, f"Sync for {selected_muni} kører allerede..."
+    return job_id, False, "Sync startet..."
 
-    try:
-        if selected_muni == "randers":
-            timesafe_path = "data/randers/TIMESAFE-Export-Ventilationsanlæg.txt"
-            buildings_path = "data/randers/Dalux/Alle_bygninger_DaluxFM_20251114_1159_6838.xlsx"
 
-            process_randers_map_data(timesafe_path, buildings_path)
-            return f"Randers Synced! ({n_clicks})"
-            
-        elif selected_muni == "faaborg":
-            # Path from your latest message
-            excel_path = "data/faaborg&midtfyn/Forbrugsoplysninger FM.xlsx"
-            rearrange_carbon_data(excel_path)
-            return f"Faaborg Synced! ✅ ({n_clicks})"
-
-        elif selected_muni == "frederiksberg":
-            muni_cfg = mapping["frederiksberg"]
-            # Runs the Frederiksberg logic using the folder and file map
-            process_frederiksberg_data(muni_cfg["folder"], muni_cfg["files"])
-            return f"Frb. Synced! ✅ ({n_clicks})"
+@app.callback(
+    [Output("sync-status", "children"),
+     Output("sync-button", "children"),
+     Output("sync-cancel", "style"),
+     Output("sync-poll", "disabled", allow_duplicate=True)],
+    Input("sync-poll", "n_intervals"),
+    State("sync-job", "data"),
+    prevent_initial_call=True
+)
+def poll_sync_job(_, job_id):
+    job = get_job(job_id) if job_id else None
+    if job is None:
+        return "", "Opdater Data (Sync JSON)", {"display": "none"}, True
+
+    if job["status"] in ("queued", "running"):
+        counter = f" ({job['done']}/{job['total']})" if job["total"] else ""
+        return f"{job['step']}{counter} · {job['elapsed']} s", "Synkroniserer...", {}, False
+
+    if job["status"] == "done":
+        status = f"Synced! ✅ {job['result']} · {job['elapsed']} s"
+    elif job["status"] == "cancelled":
+        status = "Sync annulleret"
+    else:
+        status = f"Sync Fejl! ❌ {job['error']}"
+    return status, "Opdater Data (Sync JSON)", {"display": "none"}, True
+
+
+@app.callback(
+    Output("sync-status", "children", allow_duplicate=True),
+    Input("sync-cancel", "n_clicks"),
+    State("sync-job", "data"),
+    prevent_initial_call=True
+)
+def cancel_sync(n_clicks, job_id):
+    if job_id and cancel_job(job_id):
+        return "Annullerer..."
+    return dash.no_update
 
-    except Exception as e:
-        print(f"Sync Error: {e}")
-        return "Sync Fejl! ❌"
 
-    return "Sync Data"
+# Folium maps as standalone pages: rendered once per data version to a file and
+# sent with an ETag, so a repeat visit costs one conditional GET answered by a 304
+MAP_PAGES = {
+    "randers": create_randers_map,
+}
+
+
+@app.server.route("/kort/<muni>")
+def map_page(muni):
+    if muni not in MAP_PAGES:
+        abort(404)
+    try:
+        path = cached_page(muni, f"{muni}-map", MAP_PAGES[muni])
+    except Exception as e:
+        print(f"Map page {muni} not built: {e}")
+        return Response("<h3>Kort kunne ikke indlæses. Kør venligst datasync.</h3>", status=503, mimetype="text/html")
+    with open(path, encoding="utf-8") as f:
+        response = Response(f.read(), mimetype="text/html")
+    # The ETag is the page file's name (data and code version), not send_file's file-based one:
+    # flask-compress only re-checks If-None-Match against its ":br"/":gzip" ETag for
+    # non-streamed responses, so a compressed send_file would never get its 304
+    response.set_etag(os.path.splitext(os.path.basename(path))[0])
+    response.cache_control.no_cache = True  # Always revalidate against the ETag
+    return response.make_conditional(request)
+
+
+# Map points as GeoJSON, fetched by the map pages and clustered in the browser.
+# The ETag is the data version, so the points are only sent again after a Sync.
+GEOJSON_ITEMS = {
+    "randers": "map_geojson",
+}
+
+
+@app.server.route("/data/<muni>/punkter.geojson")
+def map_points(muni):
+    if muni not in GEOJSON_ITEMS:
+        abort(404)
+    store = get_store()
+    try:
+        body = store.get(muni, GEOJSON_ITEMS[muni])
+    except Exception:
+        abort(404)
+    response = Response(body, mimetype="application/json")  # Not geo+json, which flask-compress leaves uncompressed
+    response.set_etag(store.version(muni))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 app.clientside_callback(
-    """function(n){ if(n>0) document.documentElement.classList.toggle('dark'); return ''; }""",
-    Output("dummy-output", "children"), Input("theme-toggle", "n_clicks")
+    ClientsideFunction(namespace="theme", function_name="toggle"),
+    Output("theme", "data"), Input("theme-toggle", "n_clicks"), State("plotly-templates", "data")
 )
 
 app.clientside_callback(
     """function(n){ if(n>0) window.print(); return ''; }""",
-    Output("dummy-output", "id"), Input("btn-pdf", "n_clicks")
+    Output("dummy-output", "children"), Input("btn-pdf", "n_clicks")
 )
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', debug=True, port=8050)
\ No newline at end of file
+    # Development server. Production runs app.server under a WSGI server, see wsgi.py.
+    # KL_DEBUG=1 turns on the Dash dev tools and the reloader; with the reloader this
+    # block also runs in the file-watcher process, which serves nothing.
+    debug = os.environ.get("KL_DEBUG", "0") == "1"
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warm_up()
+    app.run(host=os.environ.get("KL_HOST", "0.0.0.0"), debug=debug, port=int(os.environ.get("KL_PORT", "8050")))
@@ -0,0 +1,53 @@
+// Expands the string lookup tables of compacted figures (see figure_payload.py)
+// before Plotly draws them: {"_lookup": [...], "_index": [...]} in a trace becomes
+// the array of strings again. dcc.Graph draws through window.Plotly.react, and
+// loads Plotly on demand, so react/newPlot are wrapped as soon as it is assigned.
+(function () {
+    function expand(obj) {
+        Object.keys(obj).forEach(function (key) {
+            var value = obj[key];
+            if (!value || typeof value !== 'object' || Array.isArray(value)) return;
+            if (Array.isArray(value._lookup) && Array.isArray(value._index)) {
+                obj[key] = value._index.map(function (i) { return value._lookup[i]; });
+            } else {
+                expand(value);
+            }
+        });
+    }
+
+    // In place, so the figure Dash holds is expanded once and keeps its identity
+    function expandTraces(figure) {
+        var traces = Array.isArray(figure) ? figure : (figure && figure.data);
+        if (!Array.isArray(traces)) return;
+        traces.forEach(function (trace) {
+            if (trace && typeof trace === 'object') expand(trace);
+        });
+    }
+
+    function wrap(Plotly) {
+        ['react', 'newPlot'].forEach(function (name) {
+            var original = Plotly[name];
+            if (typeof original !== 'function' || original.expandsLookups) return;
+            var wrapped = function (gd, figure) {
+                expandTraces(figure);
+                return original.apply(this, arguments);
+            };
+            wrapped.expandsLookups = true;
+            Plotly[name] = wrapped;
+        });
+    }
+
+    if (window.Plotly) {
+        wrap(window.Plotly);
+    } else {
+        var plotly;
+        Object.defineProperty(window, 'Plotly', {
+            configurable: true,
+            get: function () { return plotly; },
+            set: function (value) {
+                plotly = value;
+                if (value) wrap(value);
+            }
+        });
+    }
+})();
@@ -0,0 +1,43 @@
+// Lazy card plots (see lazy_plot in app.py): when a card's skeleton comes within
+// 200px of the viewport, its card-visible store is set to the skeleton's token,
+// which makes the server build that card's plot. Every render of a skeleton has
+// a new token, so a card that React re-renders in place is loaded again.
+(function () {
+    var requested = new Set();     // tokens already sent to the server
+    var watching = new WeakMap();  // skeleton element -> token it is observed for
+
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            var el = entry.target;
+            var token = el.getAttribute('data-lazy-token');
+            if (!entry.isIntersecting || requested.has(token)) return;
+            requested.add(token);
+            observer.unobserve(el);
+            window.dash_clientside.set_props(
+                {type: 'card-visible', index: el.getAttribute('data-lazy-card')},
+                {data: token}
+            );
+        });
+    }, {rootMargin: '200px 0px'});
+
+    function scan() {
+        document.querySelectorAll('[data-lazy-card]').forEach(function (el) {
+            var token = el.getAttribute('data-lazy-token');
+            if (requested.has(token) || watching.get(el) === token) return;
+            watching.set(el, token);
+            // Observing afresh reports the current intersection, also for reused elements
+            observer.unobserve(el);
+            observer.observe(el);
+        });
+    }
+
+    var pending = false;
+    new MutationObserver(function () {
+        if (pending) return;
+        pending = true;
+        window.requestAnimationFrame(function () {
+            pending = false;
+            scan();
+        });
+    }).observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ['data-lazy-token']});
+})();
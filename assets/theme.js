@@ -0,0 +1,56 @@
+// Theme switching happens entirely in the browser: the "dark" class on <html> for
+// the Tailwind styles, the Plotly template of every graph on the page, and the
+// tile layer of the map iframes (see ThemeTiles in plots.py). Figures always come
+// from the server in the light template; graphs rendered later are themed as
+// they appear.
+(function () {
+    var templates = null;  // {light, dark}: Plotly templates from the "plotly-templates" store
+
+    function currentTheme() {
+        return document.documentElement.classList.contains('dark') ? 'dark' : 'light';
+    }
+
+    function themeGraph(el) {
+        var target = templates && templates[currentTheme()];
+        if (!target || !el.layout) return;
+        var template = el.layout.template || {};
+        var bg = template.layout && template.layout.paper_bgcolor;
+        // Already in the target template - this also ends the relayout -> mutation loop
+        if (bg === target.layout.paper_bgcolor) return;
+        window.Plotly.relayout(el, {template: target});
+    }
+
+    function themeMaps() {
+        var message = {type: 'kl-theme', theme: currentTheme()};
+        document.querySelectorAll('iframe').forEach(function (frame) {
+            if (frame.contentWindow) frame.contentWindow.postMessage(message, window.location.origin);
+        });
+    }
+
+    function themeAll() {
+        document.querySelectorAll('.js-plotly-plot').forEach(themeGraph);
+        themeMaps();
+    }
+
+    // New graphs (page or municipality change, filter callbacks) arrive in the light template
+    var pending = false;
+    new MutationObserver(function () {
+        if (pending || currentTheme() === 'light') return;
+        pending = true;
+        window.requestAnimationFrame(function () {
+            pending = false;
+            document.querySelectorAll('.js-plotly-plot').forEach(themeGraph);
+        });
+    }).observe(document.documentElement, {childList: true, subtree: true});
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        theme: {
+            toggle: function (n, plotlyTemplates) {
+                templates = plotlyTemplates;
+                if (n > 0) document.documentElement.classList.toggle('dark');
+                themeAll();
+                return currentTheme();
+            }
+        }
+    });
+})();
@@ -0,0 +1,432 @@
+import os
+import json
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.io.parsers import TextParser
+from pandas.errors import EmptyDataError
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from staging import load_staged_cells, load_staged_column, staged_sheet_names, stage_workbook
+
+
+# Process-wide cache of parsed workbooks/JSON files shared by all plot builders and
+# data processors. Entries are keyed by the file's mtime and size, so a changed file
+# on disk is re-parsed automatically. Least recently used entries are evicted once
+# the estimated memory use goes above CACHE_MAX_BYTES.
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Processed outputs (Arrow files) are memory-mapped, so they stay out of the Python
+# heap. Windows can't replace a file while it is mapped, which Sync does, so there
+# they are read into memory instead.
+MEMORY_MAP = os.name != 'nt'
+
+# Worker processes for per-sheet work over big workbooks (KL_EXTRACT_WORKERS=1 turns it off)
+EXTRACT_WORKERS = int(os.environ.get("KL_EXTRACT_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+# The pools are started from threaded processes (Sync jobs, web server workers), where
+# fork can copy a lock some other thread holds into the child - so they spawn
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_lock = threading.RLock()
+
+
+def file_signature(path):
+    """Returns (mtime_ns, size) for a file - changes whenever the file is rewritten."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return 0
+
+
+def _cache_get(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        _cache.move_to_end(key)
+        return entry[0]
+
+
+def _cache_put(key, value, size=None):
+    global _cache_bytes
+    size = _estimate_size(value) if size is None else size
+    if size > CACHE_MAX_BYTES:
+        return  # Too big to be worth keeping
+    with _lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _cache_bytes -= old[1]
+        _cache[key] = (value, size)
+        _cache_bytes += size
+        while _cache_bytes > CACHE_MAX_BYTES and _cache:
+            _, (_, old_size) = _cache.popitem(last=False)
+            _cache_bytes -= old_size
+
+
+def _drop_stale(path, signature):
+    """Removes entries for this file that were parsed from an older version of it."""
+    global _cache_bytes
+    with _lock:
+        for key in [k for k in _cache if k[1] == path and k[2] != signature]:
+            _cache_bytes -= _cache.pop(key)[1]
+
+
+def clear_cache():
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+
+def cache_info():
+    with _lock:
+        return {"entries": len(_cache), "bytes": _cache_bytes, "max_bytes": CACHE_MAX_BYTES}
+
+
+def _skiprows_key(skiprows):
+    return tuple(skiprows) if isinstance(skiprows, (list, tuple, range)) else skiprows
+
+
+def _convert_cell(v):
+    """Same cell conversion as pandas' openpyxl reader (values_only gives error cells as text)."""
+    if v is None:
+        return ""
+    if isinstance(v, str) and v in ERROR_CODES:
+        return np.nan
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _sheet_cells(rows):
+    """Streamed openpyxl rows -> padded list of rows, trimmed like pandas does it."""
+    data = []
+    for row in rows:
+        cells = [_convert_cell(v) for v in row]
+        while cells and cells[-1] == "":
+            cells.pop()
+        data.append(cells)
+    while data and not data[-1]:
+        data.pop()
+    if data:
+        width = max(len(r) for r in data)
+        data = [r + [""] * (width - len(r)) for r in data]
+    return data
+
+
+def _stream_cells(path, sheets=None):
+    """Reads the cells of many sheets with one read-only (streaming) pass over the workbook."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        result = {}
+        for sheet in (wb.sheetnames if sheets is None else sheets):
+            ws = wb[sheet]
+            ws.reset_dimensions()
+            result[sheet] = _sheet_cells(ws.iter_rows(values_only=True))
+        return result
+    finally:
+        wb.close()
+
+
+def _load_cells(path, sheets):
+    """Cells from the Parquet staging area when it is up to date, otherwise from Excel."""
+    return load_staged_cells(path, sheets) or _stream_cells(path, sheets)
+
+
+def _cells_to_frame(data, skiprows=None, header=0):
+    """Same TextParser call pd.read_excel makes once it has the cell values."""
+    if not data:
+        return pd.DataFrame()
+    if isinstance(header, (list, tuple)) and len(header) == 1:
+        header = header[0]
+    try:
+        return TextParser(data, header=header, skiprows=skiprows, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def read_excel_cached(path, sheet_name=0, skiprows=None, header=0):
+    """
+    Cached replacement for pd.read_excel(path, sheet_name=..., skiprows=..., header=...).
+    Returns a copy, so callers are free to modify the DataFrame.
+    sheet_name can also be a list - missing sheets are then read in one pass over
+    the workbook and a {sheet: DataFrame} dict is returned.
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    _drop_stale(path, signature)
+
+    requested = list(sheet_name) if isinstance(sheet_name, (list, tuple)) else [sheet_name]
+    sheet_names = get_sheet_names(path)
+    sheets = [sheet_names[s] if isinstance(s, int) else s for s in requested]
+
+    def key(sheet):
+        return ("excel", path, signature, sheet, _skiprows_key(skiprows), header)
+
+    frames = {s: _cache_get(key(s)) for s in sheets}
+    missing = [s for s, df in frames.items() if df is None]
+    if missing:
+        for s, data in _load_cells(path, missing).items():
+            frames[s] = _cells_to_frame(data, skiprows=skiprows, header=header)
+            _cache_put(key(s), frames[s])
+
+    if isinstance(sheet_name, (list, tuple)):
+        return {s: frames[s].copy() for s in sheets}
+    return frames[sheets[0]].copy()
+
+
+def get_sheet_names(path):
+    """Cached list of sheet names in a workbook."""
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    key = ("sheets", path, signature)
+    names = _cache_get(key)
+    if names is None:
+        names = staged_sheet_names(path)
+    if names is None:
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            names = list(wb.sheetnames)
+        finally:
+            wb.close()
+    _cache_put(key, names, size=0)
+    return list(names)
+
+
+def read_workbook_sheets(path, sheet_names=None, skip_sheets=()):
+    """
+    Reads many sheets with a single read-only (streaming) pass over the workbook,
+    instead of one pd.read_excel call per sheet. Returns {sheet: DataFrame} with the
+    raw cell grid, like pd.read_excel(..., header=None).
+    """
+    if sheet_names is None:
+        sheet_names = get_sheet_names(path)
+    sheet_names = [s for s in sheet_names if s not in skip_sheets]
+    return read_excel_cached(path, sheet_name=sheet_names, header=None)
+
+
+def _stream_column(path, sheets, column):
+    """Values of one column (found by its row 1 header) from the given sheets, blanks removed."""
+    collected = []
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in sheets:
+            ws = wb[sheet]
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header or column not in header:
+                continue
+            idx = header.index(column)
+            collected.extend(r[idx] for r in rows if idx < len(r) and r[idx] is not None)
+    finally:
+        wb.close()
+    return collected
+
+
+def _sheet_chunks(sheets, workers):
+    size = -(-len(sheets) // workers)
+    return [sheets[i:i + size] for i in range(0, len(sheets), size)]
+
+
+def _run_sheet_chunks(func, path, sheets, *args, workers=None, progress=None):
+    """
+    Calls func(path, chunk, *args) for contiguous chunks of the sheet list, one chunk
+    per worker process, and returns the results in chunk order. Runs in-process
+    when there is only one worker (or one sheet).
+    """
+    workers = min(workers or EXTRACT_WORKERS, len(sheets))
+    if workers <= 1:
+        results = [func(path, sheets, *args)] if sheets else []
+        if progress:
+            progress(1, 1)
+        return results
+    chunks = _sheet_chunks(sheets, workers)
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=_MP_CONTEXT) as pool:
+        futures = {pool.submit(func, path, chunk, *args): i for i, chunk in enumerate(chunks)}
+        results = [None] * len(chunks)
+        for n, future in enumerate(as_completed(futures)):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(n + 1, len(chunks))
+        return results
+
+
+def _extract_chunk(path, sheets, extract, header):
+    """Worker side of map_sheets: one read pass over the chunk, errors kept per sheet."""
+    try:
+        frames = read_excel_cached(path, sheet_name=list(sheets), header=header)
+    except Exception:
+        frames = {}  # Read the sheets one at a time below, to find the one that fails
+    results = []
+    for sheet in sheets:
+        try:
+            df = frames[sheet] if sheet in frames else read_excel_cached(path, sheet_name=sheet, header=header)
+            results.append((sheet, True, extract(df, sheet)))
+        except Exception as e:
+            results.append((sheet, False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def map_sheets(path, sheets, extract, header=None, workers=None, progress=None):
+    """
+    Runs extract(df, sheet) for every sheet, spread over EXTRACT_WORKERS processes.
+    extract must be a module-level function and should return something small.
+    Returns [(sheet, ok, result or error text)] in the order of sheets - a failing
+    sheet doesn't stop the others. progress(done, total) is called per finished chunk.
+    """
+    sheets = list(sheets)
+    chunk_results = _run_sheet_chunks(_extract_chunk, os.path.abspath(path), sheets, extract, header,
+                                      workers=workers, progress=progress)
+    return [r for chunk in chunk_results for r in chunk]
+
+
+def _call_isolated(func, item):
+    try:
+        return (item, True, func(item))
+    except Exception as e:
+        return (item, False, f"{type(e).__name__}: {e}")
+
+
+def map_items(func, items, workers=None, progress=None):
+    """
+    Runs func(item) for every item (e.g. one set of workbooks per building), spread
+    over EXTRACT_WORKERS processes. Like map_sheets, func must be a module-level
+    function and a failing item doesn't stop the others. Returns
+    [(item, ok, result or error text)] in the order of items; progress(done, total)
+    is called per finished item.
+    """
+    items = list(items)
+    workers = min(workers or EXTRACT_WORKERS, len(items))
+    if workers <= 1:
+        results = []
+        for n, item in enumerate(items):
+            results.append(_call_isolated(func, item))
+            if progress:
+                progress(n + 1, len(items))
+        return results
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+    try:
+        futures = {pool.submit(_call_isolated, func, item): i for i, item in enumerate(items)}
+        results = [None] * len(items)
+        for n, future in enumerate(as_completed(futures)):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(n + 1, len(items))
+        return results
+    finally:
+        # Don't start queued items if progress() raised (e.g. a cancelled sync)
+        pool.shutdown(cancel_futures=True)
+
+
+def read_column_across_sheets(path, column, skip_sheets=(), workers=None):
+    """
+    Collects one column from every sheet whose header row (row 1) contains it, with
+    one read-only pass per worker process. Sheets without the column are skipped after
+    reading only their header row. Returns one concatenated Series (in sheet order)
+    with blanks removed.
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    _drop_stale(path, signature)
+    key = ("column", path, signature, column, tuple(skip_sheets))
+
+    values = _cache_get(key)
+    if values is None:
+        sheets = [s for s in get_sheet_names(path) if s not in skip_sheets]
+        collected = load_staged_column(path, sheets, column)
+        if collected is None:
+            # Sheets are split over worker processes, each streaming its own share
+            collected = []
+            for values_part in _run_sheet_chunks(_stream_column, path, sheets, column, workers=workers):
+                collected.extend(values_part)
+        values = pd.Series(collected, name=column, dtype=object)
+        _cache_put(key, values)
+
+    return values.copy()
+
+
+def stage_workbooks(paths, force=False, progress=None):
+    """
+    Converts source workbooks to the Parquet staging area (see staging.py). Used by Sync.
+    Only changed sheets are re-read. Returns the number of sheets that were staged.
+    progress(step, done, total) is called before each workbook, if given.
+    """
+    staged = 0
+    for i, path in enumerate(paths):
+        if progress:
+            progress("Konverterer regneark", i, len(paths))
+        if not os.path.exists(path):
+            print(f"Staging skipped, file not found: {path}")
+            continue
+        staged += stage_workbook(os.path.abspath(path), _stream_cells, force=force)
+    return staged
+
+
+def cached_for_file(kind, path, build, size=0):
+    """
+    build(path) computed once per version of the file (mtime and size) and kept in
+    the shared cache. Used for lookup tables derived from a workbook. The result is
+    shared between callers, so treat it as read-only.
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    _drop_stale(path, signature)
+    key = (kind, path, signature)
+    value = _cache_get(key)
+    if value is None:
+        value = build(path)
+        _cache_put(key, value, size=size)
+    return value
+
+
+def read_json_cached(path):
+    """
+    Cached json.load() for the processed data files. The returned object is shared
+    between callers, so treat it as read-only.
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    _drop_stale(path, signature)
+    key = ("json", path, signature)
+    data = _cache_get(key)
+    if data is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Parsed JSON takes a few times the file size in Python objects
+        _cache_put(key, data, size=signature[1] * 4)
+    return data
+
+
+def _read_table(path):
+    if MEMORY_MAP:
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    with pa.OSFile(path, 'rb') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_table_cached(path):
+    """
+    The Arrow table in a processed data file (see staging.write_table_atomic),
+    memory-mapped and cached per version of the file.
+    """
+    size = 0 if MEMORY_MAP else os.path.getsize(path)
+    return cached_for_file("arrow", path, _read_table, size=size)
+
+
+def table_metadata(table, key, default=None):
+    """A value stored with write_table_atomic(..., metadata=...)."""
+    value = (table.schema.metadata or {}).get(key.encode('utf-8'))
+    return default if value is None else json.loads(value)
@@ -1,123 +1,312 @@
 import pandas as pd
 import json
 import os
+import re
+import shutil
+import pyarrow as pa
+from data_loader import read_excel_cached, read_json_cached, read_table_cached, get_sheet_names, map_items
+from staging import sheets_hash, load_sync_state, save_sync_state, write_json_atomic, write_table_atomic
 
-def process_frederiksberg_data(folder_path, file_map):
-    maint_path = os.path.join(folder_path, file_map["maintenance"])
-    proj_path = os.path.join(folder_path, file_map["projects"])
-    
+COMPLIANCE_SHEETS = ["Bygninger", "Teoretisk forbrug"]
+FRB_SECTIONS = ["maintenance", "projects", "compliance"]
+
+# Processed data, one folder of Arrow files per building (set of workbooks) plus an
+# index.json listing them. The index is written last, so its mtime marks a finished Sync.
+FRB_STORE_DIR = 'frb_processed'
+FRB_STORE_INDEX = os.path.join(FRB_STORE_DIR, 'index.json')
+
+# Version of the extract_frb_* results kept in the sync state - bump it when an
+# extraction changes, so the next Sync doesn't reuse sections extracted by the old code
+FRB_EXTRACT_VERSION = 1
+
+# Columns of each section's Arrow file, as the extract_frb_* functions return them
+FRB_SCHEMAS = {
+    "maintenance": pa.schema([("Year", pa.int64()), ("Condition", pa.string()), ("Category", pa.string()),
+                              ("Cost", pa.float64())]),
+    "projects": pa.schema([("Type", pa.string()), ("Description", pa.string()), ("DDK", pa.float64()),
+                           ("CO2", pa.float64()), ("TBT", pa.float64())]),
+    "compliance": pa.schema([("Building", pa.string()), ("Area", pa.float64()), ("Year", pa.int64()),
+                             ("EnergyMark", pa.string()), ("SavingPct", pa.float64())]),
+}
+
+
+def _reuse_or_extract(previous, state, name, path, sheets, extract):
+    """Runs extract(path) unless the sheets it reads are unchanged since the last Sync."""
+    input_hash = sheets_hash(path, sheets)
+    if previous.get(name, {}).get("hash") == input_hash:
+        print(f"Frb. {name}: unchanged, reusing previous results")
+        state[name] = previous[name]
+    else:
+        state[name] = {"hash": input_hash, "rows": extract(path)}
+    return state[name]["rows"]
+
+
+def _column(df, name, default):
+    """df[name], or a column of default values if the sheet doesn't have it."""
+    return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+
+def _numeric(df, name, default=0):
+    """A column parsed as numbers in one pass. Cells that aren't numbers become NaN."""
+    return pd.to_numeric(_column(df, name, default), errors='coerce')
+
+
+def _text(df, name, default):
+    """A column as text, matching str() of each cell ('nan' for empty cells)."""
+    return _column(df, name, default).astype(str)
+
+
+def extract_frb_maintenance(maint_path):
     # --- A. PROCESS VEDLIGEHOLDELSE (D1 & D7) ---
     # Row 1 = headers, Row 2 = useless, Row 3+ = data
-    df_m = pd.read_excel(maint_path, header=0, skiprows=[1])
+    df_m = read_excel_cached(maint_path, header=0, skiprows=[1])
     df_m.columns = [str(c).strip() for c in df_m.columns]
-    
+
     target_years = [str(year) for year in range(2023, 2034)]
-    maint_results = []
-    
+    year_cols = [yr for yr in target_years if yr in df_m.columns]
+
     cat_col = next((c for c in df_m.columns if "hovedomkost" in c.lower() or "område" in c.lower()), "Kategori")
     cond_col = next((c for c in df_m.columns if "tilstand" in c.lower()), "Tilstand")
 
-    for _, row in df_m.iterrows():
-        raw_cond = str(row.get(cond_col, "2")).strip()
-        cond_num = raw_cond[0] if raw_cond and raw_cond[0].isdigit() else "2"
-        category = str(row.get(cat_col, "Andet")).strip()
-        
-        for yr in target_years:
-            if yr in df_m.columns:
-                cost = pd.to_numeric(row[yr], errors='coerce')
-                if cost and cost > 0:
-                    maint_results.append({
-                        "Year": int(yr),
-                        "Condition": f"Grad {cond_num}",
-                        "Category": category,
-                        "Cost": float(cost)
-                    })
+    # Condition grade = first character of the Tilstand cell if it is a digit, else 2
+    first_char = _text(df_m, cond_col, "2").str.strip().str[0]
+    cond_num = first_char.where(first_char.str.isdigit().fillna(False).astype(bool), "2")
 
+    # One row per (line item, year) with a positive cost, in line item order
+    costs = df_m[year_cols].apply(pd.to_numeric, errors='coerce')
+    costs.index = range(len(costs))
+    long = costs.melt(var_name="Year", value_name="Cost", ignore_index=False)
+    long = long[long["Cost"] > 0]
+    long["_row"] = long.index
+    long = long.sort_values("_row", kind="stable")
+
+    conditions = ("Grad " + cond_num).to_numpy()[long["_row"]]
+    categories = _text(df_m, cat_col, "Andet").str.strip().to_numpy()[long["_row"]]
+    return [
+        {"Year": int(yr), "Condition": cond, "Category": cat, "Cost": float(cost)}
+        for yr, cond, cat, cost in zip(long["Year"], conditions, categories, long["Cost"])
+    ]
+
+
+def extract_frb_projects(proj_path):
     # --- B. PROCESS ENERGIPROJEKTER (D2 & D8) ---
     # Vi bruger 'Forbedringer' arket. Hvis det også har 2 headers, bruger vi header=1
-    df_p = pd.read_excel(proj_path, sheet_name="Forbedringer", header=1)
+    df_p = read_excel_cached(proj_path, sheet_name="Forbedringer", header=1)
     df_p.columns = [str(c).strip() for c in df_p.columns]
-    
-    project_results = []
-    for _, row in df_p.iterrows():
-        # Vi leder efter Investering (DDK), Besparelse (CO2) og Tilbagebetaling (TBT)
-        ddk = pd.to_numeric(row.get("Investering", 0), errors='coerce')
-        co2 = pd.to_numeric(row.get("Besparelse", 0), errors='coerce')
-        tbt = pd.to_numeric(row.get("TBT", 0), errors='coerce')
-        emne = str(row.get("Type", "Diverse"))
-        forslag = str(row.get("Titel", "Ingen titel"))
-        bygning = str(row.get("Bygninger","Ingen bygning navn"))
-        
-        if ddk > 0:
-            project_results.append({
-                "Type": emne,
-                "Description": bygning+": "+forslag,
-                "DDK": float(ddk),
-                "CO2": float(co2),
-                "TBT": float(tbt)
-            })
-
-    try:
-        comp_path = os.path.join(folder_path, file_map["compliance"])
-        
-        # Load sheets with headers on Row 2
-        df_byg = pd.read_excel(comp_path, sheet_name="Bygninger", header=1)
-        df_teo = pd.read_excel(comp_path, sheet_name="Teoretisk forbrug", header=1)
-        
-        # Clean column names
-        df_byg.columns = [str(c).strip() for c in df_byg.columns]
-        df_teo.columns = [str(c).strip() for c in df_teo.columns]
-
-        # Explicitly define the join columns based on your find
-        left_col = "Bygningsnavn" if "Bygningsnavn" in df_byg.columns else "Navn"
-        right_col = "Ejendomsnavn" if "Ejendomsnavn" in df_teo.columns else "Navn"
-
-        # Perform the merge
-        df_combined = pd.merge(
-            df_byg, 
-            df_teo, 
-            left_on=left_col, 
-            right_on=right_col, 
-            how="inner"
-        )
-
-        compliance_results = []
-        for _, row in df_combined.iterrows():
-            area = pd.to_numeric(row.get("Opvarmet areal (m²)", 0), errors='coerce')
-            year = pd.to_numeric(row.get("Opførelsesår", 0), errors='coerce')
-            mark = str(row.get("Energimærke", "U"))
-            
-            save_col = "Besparelse % (kWh)"
-            raw_val = pd.to_numeric(row.get(save_col, 0), errors='coerce')
-            
-            # 2. Logic: If Excel stores 0.20 instead of 20, convert it
-            if pd.notnull(raw_val) and 0 < raw_val < 1:
-                saving_val = raw_val * 100
-            else:
-                saving_val = raw_val if pd.notnull(raw_val) else 0
-
-            compliance_results.append({
-                "Building": str(row.get("Bygningsnavn", "Unknown")),
-                "Area": float(area) if pd.notnull(area) else 0,
-                "Year": int(year) if pd.notnull(year) else 0,
-                "EnergyMark": mark,
-                "SavingPct": round(float(saving_val), 2)
-            })
-
-        # Save integrated JSON
-        final_output = {
-            "maintenance": maint_results,
-            "projects": project_results,
-            "compliance": compliance_results
-        }
-        with open('frb_processed.json', 'w', encoding='utf-8') as f:
-            json.dump(final_output, f, indent=4, ensure_ascii=False)
-            
-        print(f"Sync Success! Merged {len(df_combined)} buildings.")
-
-    except Exception as e:
-        print(f"Sync Error: {e}")
-        # Save empty compliance list so the app doesn't crash, but keep other data
-        with open('frb_processed.json', 'w', encoding='utf-8') as f:
-            json.dump({"maintenance": maint_results, "projects": project_results, "compliance": []}, f)
-        raise e
\ No newline at end of file
+
+    # Vi leder efter Investering (DDK), Besparelse (CO2) og Tilbagebetaling (TBT)
+    ddk = _numeric(df_p, "Investering")
+    keep = ddk > 0
+    co2 = _numeric(df_p, "Besparelse")[keep]
+    tbt = _numeric(df_p, "TBT")[keep]
+    emne = _text(df_p, "Type", "Diverse")[keep]
+    description = _text(df_p, "Bygninger", "Ingen bygning navn")[keep] + ": " + _text(df_p, "Titel", "Ingen titel")[keep]
+
+    return [
+        {"Type": t, "Description": d, "DDK": float(x), "CO2": float(c), "TBT": float(b)}
+        for t, d, x, c, b in zip(emne, description, ddk[keep], co2, tbt)
+    ]
+
+
+def extract_frb_compliance(comp_path):
+    # Load sheets with headers on Row 2
+    sheets = read_excel_cached(comp_path, sheet_name=COMPLIANCE_SHEETS, header=1)
+    df_byg = sheets["Bygninger"]
+    df_teo = sheets["Teoretisk forbrug"]
+
+    # Clean column names
+    df_byg.columns = [str(c).strip() for c in df_byg.columns]
+    df_teo.columns = [str(c).strip() for c in df_teo.columns]
+
+    # Explicitly define the join columns based on your find
+    left_col = "Bygningsnavn" if "Bygningsnavn" in df_byg.columns else "Navn"
+    right_col = "Ejendomsnavn" if "Ejendomsnavn" in df_teo.columns else "Navn"
+
+    # Perform the merge
+    df_combined = pd.merge(
+        df_byg,
+        df_teo,
+        left_on=left_col,
+        right_on=right_col,
+        how="inner"
+    )
+
+    area = _numeric(df_combined, "Opvarmet areal (m²)").fillna(0)
+    year = _numeric(df_combined, "Opførelsesår").fillna(0)
+    mark = _text(df_combined, "Energimærke", "U")
+
+    # If Excel stores 0.20 instead of 20, convert it
+    raw_val = _numeric(df_combined, "Besparelse % (kWh)")
+    saving_val = raw_val.where(~((raw_val > 0) & (raw_val < 1)), raw_val * 100).fillna(0)
+
+    return [
+        {"Building": b, "Area": float(a), "Year": int(y), "EnergyMark": m, "SavingPct": round(float(sv), 2)}
+        for b, a, y, m, sv in zip(_text(df_combined, "Bygningsnavn", "Unknown"), area, year, mark, saving_val)
+    ]
+
+
+## Buildings
+
+def building_key(name):
+    """'Skolen på duevej' -> 'skolen-på-duevej' - the store's partition key."""
+    return re.sub(r'[^\w]+', '-', str(name).strip().lower()).strip('-')
+
+
+def _pattern_regex(pattern):
+    """File name glob -> regex capturing the building name at the '*'."""
+    parts = [re.escape(p).replace(r'\?', '.') for p in pattern.split('*', 1)]
+    return re.compile('(.+?)'.join(parts) + '$' if len(parts) == 2 else parts[0] + '$', re.IGNORECASE)
+
+
+def discover_frb_buildings(folder_path, patterns):
+    """
+    Finds every building's workbooks in the folder. patterns maps a role
+    (maintenance, projects, compliance, ...) to a file name pattern where '*' is the
+    building name, e.g. "* vedligeholdelsesplan.xlsx".
+    Returns {building key: {"name": ..., "files": {role: path}}}, sorted by key.
+    """
+    names = sorted(os.listdir(folder_path))
+    buildings = {}
+    for role, pattern in patterns.items():
+        regex = _pattern_regex(pattern)
+        for file_name in names:
+            m = regex.match(file_name)
+            if not m or not m.groups():
+                continue
+            entry = buildings.setdefault(building_key(m.group(1)), {"name": m.group(1).strip(), "files": {}})
+            entry["files"].setdefault(role, os.path.join(folder_path, file_name))
+    return dict(sorted(buildings.items()))
+
+
+def frb_building_sets(muni_cfg):
+    """
+    The buildings to process. With a "buildings" entry in mapping.json they are
+    discovered from the file name patterns, otherwise "files" is one building.
+    """
+    folder_path = muni_cfg["folder"]
+    if "buildings" in muni_cfg:
+        return discover_frb_buildings(folder_path, muni_cfg["buildings"])
+    name = muni_cfg.get("name", "Frederiksberg")
+    files = {role: os.path.join(folder_path, f) for role, f in muni_cfg["files"].items() if role in FRB_SECTIONS}
+    return {building_key(name): {"name": name, "files": files}}
+
+
+def process_frb_building(item):
+    """
+    Extracts one building's sections. item = (files, previous sync state of the
+    building). Sections are only extracted again if the sheets they read changed,
+    and a section without a workbook is empty. Returns (state, output).
+    """
+    files, previous = item
+    state = {}
+    readers = {
+        "maintenance": (lambda path: get_sheet_names(path)[:1], extract_frb_maintenance),
+        "projects": (lambda path: ["Forbedringer"], extract_frb_projects),
+        "compliance": (lambda path: COMPLIANCE_SHEETS, extract_frb_compliance),
+    }
+    output = {}
+    for section, (sheets, extract) in readers.items():
+        path = files.get(section)
+        if path and os.path.exists(path):
+            output[section] = _reuse_or_extract(previous, state, section, path, sheets(path), extract)
+        else:
+            output[section] = []
+    return state, output
+
+
+## Store
+
+def _partition_dir(key):
+    return os.path.join(FRB_STORE_DIR, key)
+
+
+def write_frb_store(buildings, outputs):
+    """
+    Writes the changed partitions (one Arrow file per section in a folder per
+    building), drops those of buildings that are gone, then the index.
+    """
+    os.makedirs(FRB_STORE_DIR, exist_ok=True)
+    for key, output in outputs.items():
+        os.makedirs(_partition_dir(key), exist_ok=True)
+        for section, rows in output.items():
+            write_table_atomic(os.path.join(_partition_dir(key), f"{section}.arrow"), rows, schema=FRB_SCHEMAS[section])
+
+    index = {"buildings": {}}
+    for key, building in buildings.items():
+        if not os.path.isdir(_partition_dir(key)):
+            continue  # Failed on its first Sync
+        counts = {section: len(rows) for section, rows in outputs[key].items()} if key in outputs else \
+            read_frb_index()["buildings"].get(key, {}).get("counts", {})
+        index["buildings"][key] = {"name": building["name"], "dir": key, "counts": counts}
+    for name in os.listdir(FRB_STORE_DIR):
+        if name != "index.json" and name not in index["buildings"]:
+            path = os.path.join(FRB_STORE_DIR, name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    write_json_atomic(FRB_STORE_INDEX, index)
+
+
+def read_frb_index():
+    if not os.path.exists(FRB_STORE_INDEX):
+        return {"buildings": {}}
+    return read_json_cached(FRB_STORE_INDEX)
+
+
+def frb_buildings():
+    """{building key: name} for the buildings in the store (empty before the first Sync)."""
+    return {key: b["name"] for key, b in read_frb_index()["buildings"].items()}
+
+
+def load_frb_partitions(section):
+    """{building key: DataFrame} of one section (maintenance, projects, compliance) for every building in the store."""
+    index = read_frb_index()["buildings"]
+    return {
+        key: read_table_cached(os.path.join(FRB_STORE_DIR, entry["dir"], f"{section}.arrow")).to_pandas()
+        for key, entry in index.items()
+    }
+
+
+def select_frb_rows(partitions, buildings=None):
+    """The partitions of the given building keys in one DataFrame (every building if buildings is empty)."""
+    frames = [partitions[k] for k in (buildings or partitions) if k in partitions and not partitions[k].empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def process_frederiksberg_data(muni_cfg, progress=None):
+    """
+    Processes every building's workbooks (in parallel, see map_items) into the
+    partitioned store. A building that fails keeps its previous partition.
+    Returns the number of buildings in the store.
+    """
+    buildings = frb_building_sets(muni_cfg)
+    if not buildings:
+        raise FileNotFoundError(f"No Frederiksberg workbooks found in {muni_cfg['folder']}")
+
+    previous = load_sync_state("frederiksberg", FRB_EXTRACT_VERSION)
+    keys = list(buildings)
+
+    def building_done(done, total):
+        if progress:
+            progress("Frederiksberg bygninger", done, total)
+
+    building_done(0, len(keys))
+    results = map_items(process_frb_building,
+                        [(buildings[k]["files"], previous.get(k, {})) for k in keys],
+                        progress=building_done)
+
+    state, outputs, failed = {}, {}, []
+    for key, (_, ok, result) in zip(keys, results):
+        if ok:
+            state[key], outputs[key] = result
+        else:
+            failed.append(key)
+            print(f"Sync Error ({buildings[key]['name']}): {result}")
+            if key in previous:
+                state[key] = previous[key]
+    save_sync_state("frederiksberg", state, FRB_EXTRACT_VERSION)
+    write_frb_store(buildings, outputs)
+
+    n_buildings = len(frb_buildings())
+    print(f"Sync Success! {len(outputs)} of {len(keys)} buildings processed, {n_buildings} in the store.")
+    if not outputs:
+        raise RuntimeError(f"All {len(keys)} Frederiksberg buildings failed")
+    return n_buildings
@@ -1,11 +1,56 @@
 import pandas as pd
+import numpy as np
 import json
-import time
+import os
+import pyarrow as pa
 from io import StringIO
-from geopy.geocoders import Nominatim
+from data_loader import read_excel_cached, get_sheet_names, cached_for_file, read_table_cached
+from staging import file_sha256, sheets_hash, load_sync_state, save_sync_state, load_derived, save_derived, write_table_atomic
+from geocoding import geocode_addresses
+from name_index import NameIndex
+
+# Map points written by Sync (Arrow, one row per point), with the match report in
+# the file's metadata
+RANDERS_PROCESSED = 'randers_processed.arrow'
+RANDERS_SCHEMA = pa.schema([("name", pa.string()), ("address", pa.string()), ("lat", pa.float64()),
+                            ("lon", pa.float64()), ("color", pa.string()), ("status", pa.string())])
+# Version of the matching/geocoding that produced the stored points - bump it when
+# that changes, so the next Sync processes unchanged inputs again
+RANDERS_MAP_VERSION = 1
+
+
+def match_building(index, names, addresses, loc_name):
+    """
+    Finds the Dalux building for a Timesafe location name. Returns (address, issue),
+    where issue is None for a clear match, otherwise a dict for the match report.
+    """
+    hits = index.search(loc_name)
+    if not hits:
+        suggestions = {}
+        for i, score in index.similar(loc_name, limit=10):
+            suggestions.setdefault(names[i], round(score, 2))
+        suggestions = [{"name": n, "score": score} for n, score in list(suggestions.items())[:3]]
+        return '', {"name": loc_name, "suggestions": suggestions}
+
+    address = addresses[hits[0][0]]
+    tied = [i for i, score in hits if score == hits[0][1]]
+    if len({addresses[i] for i in tied}) > 1:
+        candidates = [{"name": names[i], "address": addresses[i], "score": round(score, 2)} for i, score in hits]
+        return address, {"name": loc_name, "used": address, "candidates": candidates}
+    return address, None
+
+
+def process_randers_map_data(timesafe_txt_path, buildings_xlsx_path, progress=None):
+    # Geocoding is slow, so skip everything when neither input has changed since the last Sync
+    try:
+        inputs = f"{file_sha256(timesafe_txt_path)}:{sheets_hash(buildings_xlsx_path, get_sheet_names(buildings_xlsx_path)[:1])}"
+    except OSError:
+        inputs = None  # Missing input, reported by the loading steps below
+    if inputs and load_sync_state("randers_map", RANDERS_MAP_VERSION).get("inputs") == inputs and os.path.exists(RANDERS_PROCESSED):
+        n_points = read_table_cached(RANDERS_PROCESSED).num_rows
+        print(f"Randers inputs unchanged, keeping {n_points} map points.")
+        return n_points
 
-def process_randers_map_data(timesafe_txt_path, buildings_xlsx_path):
-    geolocator = Nominatim(user_agent="randers_energy_map_final")
     print("\n--- Starting Data Processing (Randers) ---")
 
     # 1. LOAD TIMESAFE (Correcting the 'Chinese' encoding error)
@@ -28,7 +73,7 @@ def process_randers_map_data(timesafe_txt_path, buildings_xlsx_path):
     # 2. LOAD BUILDING LIST
     try:
         # Since your terminal said 'Filen var faktisk en Excel-fil', we use read_excel
-        df_byg = pd.read_excel(buildings_xlsx_path)
+        df_byg = read_excel_cached(buildings_xlsx_path)
         print(f"Success: Building list loaded. Found {len(df_byg)} buildings.")
     except Exception as e:
         print(f"Error loading Building list: {e}")
@@ -38,47 +83,149 @@ def process_randers_map_data(timesafe_txt_path, buildings_xlsx_path):
     df_ts.columns = [c.strip() for c in df_ts.columns]
     df_byg.columns = [c.strip() for c in df_byg.columns]
 
-    map_results = []
-    
-    # 3. MATCHING & GEOCODING
+    # 3. MATCHING
+    # Units sharing a LOKATION_NAVN are matched once, and each distinct address is
+    # geocoded once (and cached on disk between runs, see geocoding.py)
+    # Building names are looked up in a trigram index instead of a str.contains
+    # scan of the whole building list per location
+    names = df_byg['Institutionsnavn'].astype(str).tolist()
+    addresses = ['' if a.lower() == 'nan' else a for a in df_byg.get('Adresse', pd.Series('', index=df_byg.index)).astype(str).str.strip()]
+    index = NameIndex(df_byg['Institutionsnavn'].tolist())
+    report = {"unmatched": [], "ambiguous": []}
+
+    address_by_name = {}
+    units = []
     for _, ts_row in df_ts.iterrows():
         # Get the location name from Timesafe (e.g., 'Kulturhuset')
         loc_name = str(ts_row.get('LOKATION_NAVN', '')).strip()
         if not loc_name or loc_name.lower() == 'nan':
             continue
-        
-        # Look for this name in the Building List (Institutionsnavn)
-        match = df_byg[df_byg['Institutionsnavn'].str.contains(loc_name, case=False, na=False)]
-        
-        if not match.empty:
-            target = match.iloc[0]
-            address = str(target.get('Adresse', '')).strip()
-            
-            # If we found an address, geocode it to get Lat/Lon
-            if address and address.lower() != 'nan':
-                full_query = f"{address}, Randers, Denmark"
-                try:
-                    location = geolocator.geocode(full_query)
-                    if location:
-                        status = str(ts_row.get('ENHED_TILSTAND', 'Grøn'))
-                        color = 'red' if 'Rød' in status else 'orange' if 'Gul' in status else 'gray' if 'Ukendt' in status else 'green'
-                        
-                        map_results.append({
-                            "name": loc_name,
-                            "address": address,
-                            "lat": location.latitude,
-                            "lon": location.longitude,
-                            "color": color,
-                            "status": status
-                        })
-                        print(f"Mapped: {loc_name} at {address}")
-                        time.sleep(1.1) # Wait to respect geocoder terms
-                except Exception as ge_err:
-                    print(f"Geocoding failed for {address}: {ge_err}")
-
-    # 4. SAVE TO JSON
-    with open('randers_processed.json', 'w', encoding='utf-8') as f:
-        json.dump({"map_points": map_results}, f, indent=4, ensure_ascii=False)
+
+        if loc_name not in address_by_name:
+            # Look for this name in the Building List (Institutionsnavn)
+            address, issue = match_building(index, names, addresses, loc_name)
+            if issue:
+                report["ambiguous" if address else "unmatched"].append(issue)
+            address_by_name[loc_name] = address
+
+        address = address_by_name[loc_name]
+        if address:
+            units.append((loc_name, address, str(ts_row.get('ENHED_TILSTAND', 'Grøn'))))
+
+    print(f"Matched {len(address_by_name) - len(report['unmatched'])} of {len(address_by_name)} locations "
+          f"({len(report['ambiguous'])} ambiguous, {len(report['unmatched'])} unmatched)")
+
+    # 4. GEOCODING
+    points = geocode_addresses([f"{address}, Randers, Denmark" for _, address, _ in units], progress=progress)
+
+    map_results = []
+    for loc_name, address, status in units:
+        point = points.get(f"{address}, Randers, Denmark")
+        if point:
+            color = 'red' if 'Rød' in status else 'orange' if 'Gul' in status else 'gray' if 'Ukendt' in status else 'green'
+
+            map_results.append({
+                "name": loc_name,
+                "address": address,
+                "lat": point[0],
+                "lon": point[1],
+                "color": color,
+                "status": status
+            })
+            print(f"Mapped: {loc_name} at {address}")
+
+    # 5. SAVE
+    write_table_atomic(RANDERS_PROCESSED, map_results, schema=RANDERS_SCHEMA, metadata={"match_report": report})
+    save_sync_state("randers_map", {"inputs": inputs}, RANDERS_MAP_VERSION)
     
     print(f"Processing Complete! {len(map_results)} points saved for the map.")
-    return len(map_results)
\ No newline at end of file
+    return len(map_results)
+
+def map_points_geojson(table):
+    """
+    The map points as a GeoJSON FeatureCollection (serialised), with name, address,
+    status and color as properties. Served to the map, which clusters them in the browser.
+    """
+    columns = table.to_pydict()
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, 6), round(lat, 6)]},
+            "properties": {"name": name, "address": address, "status": status, "color": color},
+        }
+        for name, address, lat, lon, color, status in zip(
+            columns["name"], columns["address"], columns["lat"], columns["lon"], columns["color"], columns["status"])
+    ]
+    return json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False, separators=(',', ':'))
+
+
+# Building characteristics chart: buildings per construction-year bin, stacked by
+# energy label, with the addresses in each bar segment as hover text
+ENERGY_LABEL_ORDER = ["A2020", "A2015", "A2010", "B", "C", "D", "E", "F", "G"]
+CHARACTERISTICS_BINS = 30
+CHARACTERISTICS_HOVER_ADDRESSES = 15
+
+
+def _hover_text(addresses):
+    display = "<br>".join(addresses[:CHARACTERISTICS_HOVER_ADDRESSES])
+    if len(addresses) > CHARACTERISTICS_HOVER_ADDRESSES:
+        display += f"<br>... +{len(addresses) - CHARACTERISTICS_HOVER_ADDRESSES} mere"
+    return display
+
+
+def aggregate_building_characteristics(df, age_col, label_col):
+    """
+    Counts and hover texts per (energy label, age bin), computed with one groupby.
+    Returns {"bin_edges": [...], "labels": {label: {"counts": [...], "hover": [...]}}}
+    with one list entry per bin and only the labels that occur.
+    """
+    df = df.copy()
+    df[age_col] = pd.to_numeric(df[age_col], errors='coerce')
+    df = df.dropna(subset=[age_col, label_col])
+
+    # Pick address column for hover info
+    addr_col = 'Adresse' if 'Adresse' in df.columns else (
+        'Bygningsnavn' if 'Bygningsnavn' in df.columns else None
+    )
+
+    bin_edges = np.linspace(df[age_col].min(), df[age_col].max(), CHARACTERISTICS_BINS + 1)
+    df['_bin'] = pd.cut(df[age_col], bins=bin_edges, include_lowest=True, labels=False)
+    df = df[df[label_col].isin(ENERGY_LABEL_ORDER) & df['_bin'].notna()]
+    df['_bin'] = df['_bin'].astype(int)
+
+    counts = df.groupby([label_col, '_bin']).size()
+    hover = pd.Series(dtype=object)
+    if addr_col:
+        addresses = df.dropna(subset=[addr_col])
+        cleaned = addresses[addr_col].astype(str).str.split(',').str[0].str.strip()
+        hover = cleaned.groupby([addresses[label_col], addresses['_bin']], sort=False).agg(lambda a: _hover_text(a.tolist()))
+
+    labels = {}
+    for label in ENERGY_LABEL_ORDER:
+        if label not in counts.index.get_level_values(0):
+            continue
+        label_counts = counts.loc[label]
+        label_hover = hover.loc[label] if label in hover.index.get_level_values(0) else pd.Series(dtype=object)
+        labels[label] = {
+            "counts": [int(label_counts.get(i, 0)) for i in range(CHARACTERISTICS_BINS)],
+            "hover": [label_hover.get(i, "") for i in range(CHARACTERISTICS_BINS)],
+        }
+    return {"bin_edges": bin_edges.tolist(), "labels": labels}
+
+
+def get_building_characteristics(file_path, cfg):
+    """
+    The aggregate for the building register described by a mapping.json
+    "building_data" entry. Sync saves it next to the staged data, so the chart only
+    re-reads the register when the file (or its column setup) changes.
+    """
+    def build(path):
+        saved = load_derived("building_characteristics", path)
+        if saved is not None and saved.get("config") == cfg:
+            return saved["aggregate"]
+        df = read_excel_cached(path, sheet_name=cfg["sheet"], skiprows=cfg["skiprows"])
+        aggregate = aggregate_building_characteristics(df, cfg["columns"]["age"], cfg["columns"]["label"])
+        save_derived("building_characteristics", path, {"config": cfg, "aggregate": aggregate})
+        return aggregate
+
+    return cached_for_file(("building_characteristics", json.dumps(cfg, sort_keys=True)), file_path, build)
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from data_loader import read_excel_cached, read_column_across_sheets, read_table_cached
+from data_processing import load_energi_oversigt, get_faaborg_trend_table, CARBON_PROCESSED
+from data_processing_randers import get_building_characteristics, map_points_geojson, RANDERS_PROCESSED
+from data_processing_fbr import FRB_SECTIONS, FRB_STORE_INDEX, frb_buildings, load_frb_partitions
+from staging import STAGING_DIR, source_workbooks, write_text_atomic
+
+
+# Everything the figure builders read lives in one DataStore: mapping.json plus, per
+# municipality, the loaded tables. It is filled by a warm-up thread when the server
+# starts (or on first use) and never changes after that - Sync builds a new store for
+# the synced municipality and swaps it in, so a render sees either the old data or
+# the new, never a mix of the two.
+MUNICIPALITIES = ["randers", "faaborg", "frederiksberg"]
+
+# Processed files written by Sync, per municipality
+PROCESSED_OUTPUTS = {
+    "randers": [RANDERS_PROCESSED],
+    "faaborg": [CARBON_PROCESSED],
+    "frederiksberg": [FRB_STORE_INDEX],
+}
+
+# Under a multi-worker server every process has its own store, and a Sync runs in
+# one of them. That worker records a new generation for the municipality in its
+# file in GENERATIONS_DIR; the others check the files at most every
+# GENERATION_CHECK_SECONDS and reload the municipality in the background. One file
+# per municipality, so workers finishing syncs of different municipalities at the
+# same time never overwrite each other's generation.
+GENERATIONS_DIR = os.path.join(STAGING_DIR, 'generations')
+GENERATION_CHECK_SECONDS = 2.0
+
+_store = None
+_swap_lock = threading.RLock()
+_generations = {}  # muni -> generation the current store has loaded
+_generations_checked = 0.0
+_generations_stamp = None
+
+
+def data_version(muni):
+    """Hash of the size and mtime of every file the municipality's figures read."""
+    paths = ['mapping.json'] + PROCESSED_OUTPUTS.get(muni, [])
+    try:
+        with open('mapping.json', 'r', encoding='utf-8') as f:
+            paths += source_workbooks(muni, json.load(f))
+    except (OSError, ValueError):
+        pass
+    h = hashlib.sha1(muni.encode('utf-8'))
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_mtime_ns}:{st.st_size};".encode('utf-8'))
+        except OSError:
+            h.update(f"{path}:missing;".encode('utf-8'))
+    return h.hexdigest()
+
+
+## Loaders: one per item a figure builder reads, called with the parsed mapping.json
+
+def _file(mapping, muni, name):
+    cfg = mapping[muni][name]
+    return os.path.join(mapping[muni]["folder"], cfg["file"]), cfg
+
+
+def _load_roi(mapping):
+    path, cfg = _file(mapping, "randers", "roi_data")
+    return read_excel_cached(path, sheet_name=cfg["sheet"], skiprows=cfg["skiprows"])
+
+
+def _load_characteristics(mapping):
+    path, cfg = _file(mapping, "randers", "building_data")
+    return get_building_characteristics(path, cfg)
+
+
+def _load_filter_dates(mapping):
+    path, _ = _file(mapping, "faaborg", "db6_ventilation")
+    # One streaming pass over the 60+ sheets, keeping only the filter-change dates. In
+    # this process: it runs at render/warm-up time inside the web server's threads
+    return read_column_across_sheets(path, 'Dato for filterskifte', skip_sheets=["NY", "Skabelon", "Forside"], workers=1)
+
+
+LOADERS = {
+    "randers": {
+        "roi": _load_roi,
+        "characteristics": _load_characteristics,
+        "map_points": lambda mapping: read_table_cached(RANDERS_PROCESSED).to_pylist(),
+        "map_geojson": lambda mapping: map_points_geojson(read_table_cached(RANDERS_PROCESSED)).encode('utf-8'),
+    },
+    "faaborg": {
+        "energi_oversigt": lambda mapping: load_energi_oversigt(_file(mapping, "faaborg", "db2_energy")[0]),
+        "trend_table": lambda mapping: get_faaborg_trend_table(_file(mapping, "faaborg", "db2_energy")[0]),
+        "procurement": lambda mapping: read_excel_cached(_file(mapping, "faaborg", "db5_procurement")[0], sheet_name="Priskatalog"),
+        "filter_dates": _load_filter_dates,
+    },
+    "frederiksberg": {
+        "buildings": lambda mapping: frb_buildings(),
+        **{section: (lambda mapping, section=section: load_frb_partitions(section)) for section in FRB_SECTIONS},
+    },
+}
+
+
+class DataStore:
+    """
+    Snapshot of the data behind the figures. get() loads an item once - concurrent
+    callers wait for the same load - and afterwards always returns that object, so
+    callers must copy DataFrames before changing them. A failed load is kept too and
+    raised again on every get(), until the next Sync or restart.
+    """
+
+    def __init__(self, mapping, previous=None, reload=()):
+        self.mapping = mapping
+        self._items = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        for muni in MUNICIPALITIES:
+            # Keep what the previous store loaded, unless the municipality was synced or its config changed
+            if previous is not None and muni not in reload and previous.mapping.get(muni) == mapping.get(muni):
+                self._versions[muni] = previous.version(muni)
+                self._items.update({k: v for k, v in previous._items.items() if k[0] == muni})
+            else:
+                self._versions[muni] = data_version(muni)
+
+    def version(self, muni):
+        """Data version the snapshot of muni was loaded at - part of the figure cache key."""
+        return self._versions.get(muni) or data_version(muni)
+
+    def get(self, muni, name):
+        key = (muni, name)
+        with self._lock:
+            entry = self._items.get(key)
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        if entry is None:
+            with load_lock:
+                entry = self._items.get(key)
+                if entry is None:
+                    try:
+                        entry = (True, LOADERS[muni][name](self.mapping))
+                    except Exception as e:
+                        entry = (False, e)
+                    with self._lock:
+                        self._items[key] = entry
+        ok, value = entry
+        if not ok:
+            raise value
+        return value
+
+    def warm(self, munis=MUNICIPALITIES):
+        """Loads every item of the given municipalities."""
+        for muni in munis:
+            for name in LOADERS.get(muni, {}):
+                try:
+                    self.get(muni, name)
+                except Exception as e:
+                    print(f"Data store: {muni}/{name} not loaded: {e}")
+
+
+def _read_mapping():
+    with open('mapping.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _generation_path(muni):
+    return os.path.join(GENERATIONS_DIR, f"{muni}.txt")
+
+
+def _read_generations():
+    generations = {}
+    for muni in MUNICIPALITIES:
+        try:
+            with open(_generation_path(muni), 'r', encoding='utf-8') as f:
+                generations[muni] = f.read().strip()
+        except OSError:
+            pass
+    return generations
+
+
+def _generations_file_stamp():
+    return tuple(_file_stamp(_generation_path(muni)) for muni in MUNICIPALITIES)
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _check_generations():
+    """Starts a background reload of every municipality another worker has synced."""
+    global _generations_checked, _generations_stamp
+    now = time.monotonic()
+    if now - _generations_checked < GENERATION_CHECK_SECONDS:
+        return
+    _generations_checked = now
+    stamp = _generations_file_stamp()
+    if stamp == _generations_stamp:
+        return
+    _generations_stamp = stamp
+    for muni, generation in _read_generations().items():
+        if _generations.get(muni) != generation:
+            threading.Thread(target=refresh_store, args=(muni, generation), name=f"data-store-{muni}", daemon=True).start()
+
+
+def get_store():
+    """The current DataStore (created, but not warmed, on first use)."""
+    global _store, _generations_stamp
+    if _store is None:
+        with _swap_lock:
+            if _store is None:
+                _generations_stamp = _generations_file_stamp()
+                _generations.update(_read_generations())
+                _store = DataStore(_read_mapping())
+    _check_generations()
+    return _store
+
+
+def start_warm_up():
+    """Loads every municipality's data in a background thread, so the first user doesn't wait for it."""
+    thread = threading.Thread(target=lambda: get_store().warm(), name="data-store-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def refresh_store(muni, generation=None):
+    """
+    Loads muni again into a new store (re-reading mapping.json, carrying the other
+    municipalities over) and swaps it in. Called after a Sync, without generation,
+    which then records a new generation for the other workers; and by
+    _check_generations with the generation another worker recorded.
+    """
+    global _store
+    with _swap_lock:  # One refresh at a time, each building on the latest store
+        if generation is not None and _generations.get(muni) == generation:
+            return
+        store = DataStore(_read_mapping(), previous=_store, reload={muni})
+        store.warm([muni])
+        _store = store
+        if generation is None:
+            generation = uuid.uuid4().hex
+            os.makedirs(GENERATIONS_DIR, exist_ok=True)
+            write_text_atomic(_generation_path(muni), generation)
+        _generations[muni] = generation
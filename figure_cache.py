@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from data_store import get_store
+from staging import STAGING_DIR, write_text_atomic
+from figure_payload import compact_figure
+
+
+# Built figures, stored as compacted figure JSON (see figure_payload) and keyed by (builder, arguments,
+# municipality data version). The data version is the one of the current DataStore
+# snapshot, so figures built from data that a Sync has since replaced are never
+# served from the cache. Least recently used figures are evicted first.
+# Whole HTML pages (the Folium maps) are instead written once per data version to
+# PAGES_DIR and served as static files, see cached_page.
+PAGES_DIR = os.path.join(STAGING_DIR, 'pages')
+FIGURE_CACHE_MAX_ENTRIES = 64
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Figures are built in a small thread pool. A figure requested while it is being
+# built waits for that build instead of starting another, and a page render can
+# start all of its figures at once (prefetch_figures). Waiting for a build gives
+# up after FIGURE_TIMEOUT seconds.
+FIGURE_WORKERS = 4
+FIGURE_TIMEOUT = 60
+
+_figures = OrderedDict()
+_figures_bytes = 0
+_building = {}  # key -> Future of the build in progress
+_payload_bytes = {"json": 0, "compact": 0}  # Figure JSON sizes before/after compact_figure, over all builds
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=FIGURE_WORKERS, thread_name_prefix="figures")
+_page_lock = threading.Lock()
+_page_code = {}  # builder module -> hash of its source, see _page_code_version
+
+
+class FigureTimeout(Exception):
+    """Raised by cached_figure when a figure isn't built within FIGURE_TIMEOUT seconds."""
+
+
+def _serialise(value):
+    """Figures -> JSON text, tuples element-wise, anything else (e.g. map HTML) as is."""
+    if isinstance(value, tuple):
+        return tuple(_serialise(v) for v in value)
+    if hasattr(value, 'to_json'):
+        figure_json = value.to_json()
+        compacted = json.dumps(compact_figure(json.loads(figure_json)), separators=(',', ':'))
+        with _lock:
+            _payload_bytes["json"] += len(figure_json)
+            _payload_bytes["compact"] += len(compacted)
+        return ("figure", compacted)
+    return ("raw", value)
+
+
+def _deserialise(value):
+    if isinstance(value, tuple) and value and value[0] in ("figure", "raw"):
+        kind, payload = value
+        return json.loads(payload) if kind == "figure" else payload
+    return tuple(_deserialise(v) for v in value)
+
+
+def _payload_size(value):
+    if isinstance(value, tuple) and value and value[0] in ("figure", "raw"):
+        return len(value[1]) if isinstance(value[1], str) else 0
+    return sum(_payload_size(v) for v in value)
+
+
+def _build_figure(key, builder, args, kwargs):
+    global _figures_bytes
+    try:
+        stored = _serialise(builder(*args, **kwargs))
+    except BaseException:
+        with _lock:
+            _building.pop(key, None)
+        raise
+    size = _payload_size(stored)
+    with _lock:
+        _building.pop(key, None)
+        old = _figures.pop(key, None)
+        if old is not None:
+            _figures_bytes -= old[1]
+        _figures[key] = (stored, size)
+        _figures_bytes += size
+        while _figures and (len(_figures) > FIGURE_CACHE_MAX_ENTRIES or _figures_bytes > FIGURE_CACHE_MAX_BYTES):
+            _, (_, old_size) = _figures.popitem(last=False)
+            _figures_bytes -= old_size
+    return stored
+
+
+def submit_figure(muni, builder, *args, **kwargs):
+    """
+    Future of builder(*args, **kwargs) in its serialised cache form: already done
+    when the figure is cached, else the build in the figure pool - the one already
+    running if another request started it.
+    """
+    key = (builder.__name__, args, tuple(sorted(kwargs.items())), get_store().version(muni))
+    with _lock:
+        entry = _figures.get(key)
+        if entry is not None:
+            _figures.move_to_end(key)
+            future = Future()
+            future.set_result(entry[0])
+            return future
+        future = _building.get(key)
+        if future is None:
+            future = _executor.submit(_build_figure, key, builder, args, kwargs)
+            _building[key] = future
+    return future
+
+
+def cached_figure(muni, builder, *args, **kwargs):
+    """
+    builder(*args, **kwargs) served from the figure cache. Figures come back as
+    plain figure dicts (what dcc.Graph receives anyway), so callers must not rely
+    on go.Figure methods. Raises FigureTimeout when the build takes longer than
+    FIGURE_TIMEOUT seconds; it then still finishes into the cache. A builder that
+    fails raises here too and nothing is cached, so the next request builds again -
+    builders raise instead of returning error figures, callers show the error.
+    """
+    try:
+        return _deserialise(submit_figure(muni, builder, *args, **kwargs).result(timeout=FIGURE_TIMEOUT))
+    except FuturesTimeout:
+        raise FigureTimeout(f"{builder.__name__} took more than {FIGURE_TIMEOUT} s") from None
+
+
+def prefetch_figures(muni, specs):
+    """Starts building every (builder, args, kwargs) in specs, without waiting for them."""
+    for builder, args, kwargs in specs:
+        submit_figure(muni, builder, *args, **kwargs)
+
+
+def clear_figures():
+    """Drops every cached figure - called when a Sync finishes."""
+    global _figures_bytes
+    with _lock:
+        _figures.clear()
+        _figures_bytes = 0
+
+
+def figure_cache_info():
+    with _lock:
+        return {"entries": len(_figures), "bytes": _figures_bytes, "payload_bytes": dict(_payload_bytes)}
+
+
+def _page_code_version(builder):
+    """Hash of the source file of the builder's module, so a code change renders the pages anew."""
+    module = builder.__module__
+    if module not in _page_code:
+        with open(sys.modules[module].__file__, 'rb') as f:
+            _page_code[module] = hashlib.sha1(f.read()).hexdigest()[:8]
+    return _page_code[module]
+
+
+def cached_page(muni, name, builder, *args):
+    """
+    Path of the HTML page builder(*args) rendered at the current data version of
+    muni. The page is built on first request and written to PAGES_DIR under a
+    name that includes the version and the builder's code version; pages of older
+    versions are removed. If the builder raises, nothing is written and the
+    exception propagates.
+    """
+    version = get_store().version(muni)
+    path = os.path.join(PAGES_DIR, f"{name}-{version[:16]}-{_page_code_version(builder)}.html")
+    if os.path.exists(path):
+        return path
+    with _page_lock:  # One build per page, concurrent requests wait for it
+        if not os.path.exists(path):
+            html = builder(*args)
+            os.makedirs(PAGES_DIR, exist_ok=True)
+            write_text_atomic(path, html)
+            for old in glob.glob(os.path.join(glob.escape(PAGES_DIR), f"{glob.escape(name)}-*.html")):
+                if old != path:
+                    try:
+                        os.remove(old)
+                    except OSError:
+                        pass
+    return path
@@ -0,0 +1,83 @@
+import base64
+import numpy as np
+
+
+# Figures go to the browser as JSON. compact_figure makes that JSON smaller
+# without changing what is shown:
+# - numeric arrays (Plotly's {"dtype", "bdata"} typed arrays) of whole numbers
+#   are stored as the smallest integer type that holds them, and other float64
+#   arrays as float32 when that changes no value by more than DISPLAY_TOLERANCE;
+# - other floats are rounded to FLOAT_DECIMALS decimals;
+# - string arrays in the traces with many repeats (hover texts, names) are stored
+#   as a lookup table of the distinct strings plus an index per point. The
+#   browser expands them again before Plotly draws (assets/figure_payload.js).
+DISPLAY_TOLERANCE = 0.005
+FLOAT_DECIMALS = 6
+DEDUP_MIN_LENGTH = 20    # Shorter string arrays are left as they are,
+DEDUP_MAX_DISTINCT = 0.5  # as are arrays where more than half the strings are distinct
+
+_INT_TYPES = [("i1", np.int8), ("u1", np.uint8), ("i2", np.int16), ("u2", np.uint16), ("i4", np.int32), ("u4", np.uint32)]
+
+
+def _typed_array(dtype, values):
+    return {"dtype": dtype, "bdata": base64.b64encode(np.ascontiguousarray(values).tobytes()).decode("ascii")}
+
+
+def _compact_typed_array(spec):
+    if spec.get("dtype") != "f8":
+        return spec
+    values = np.frombuffer(base64.b64decode(spec["bdata"]), dtype="<f8")
+    if not len(values) or not np.isfinite(values).all():
+        return spec
+    if (values == np.round(values)).all():
+        for dtype, np_type in _INT_TYPES:
+            info = np.iinfo(np_type)
+            if info.min <= values.min() and values.max() <= info.max:
+                return {**spec, **_typed_array(dtype, values.astype(np_type))}
+        return spec
+    as_float32 = values.astype(np.float32)
+    if np.abs(as_float32 - values).max() <= DISPLAY_TOLERANCE:
+        return {**spec, **_typed_array("f4", as_float32)}
+    return spec
+
+
+def _compact_strings(values):
+    """A {"_lookup", "_index"} table for a string array with many repeats, else the array."""
+    if len(values) < DEDUP_MIN_LENGTH or not all(isinstance(v, str) for v in values):
+        return values
+    positions = {}
+    index = [positions.setdefault(v, len(positions)) for v in values]
+    if len(positions) > DEDUP_MAX_DISTINCT * len(values):
+        return values
+    return {"_lookup": list(positions), "_index": index}
+
+
+def _compact(value, in_trace):
+    if isinstance(value, float):
+        return round(value, FLOAT_DECIMALS)
+    if isinstance(value, dict):
+        if "bdata" in value and "dtype" in value:
+            return _compact_typed_array(value)
+        return {k: _compact(v, in_trace) for k, v in value.items()}
+    if isinstance(value, list):
+        # Only a trace's (or its sub-dicts') own string arrays become lookup tables, not
+        # lists inside arrays (2-D text, dicts in arrays): the browser only expands those
+        value = [_compact(v, False) for v in value]
+        return _compact_strings(value) if in_trace else value
+    return value
+
+
+def compact_figure(figure):
+    """Compacted copy of a figure dict (as from json.loads(fig.to_json()))."""
+    compacted = dict(figure)
+    compacted["data"] = [_compact(trace, True) for trace in figure.get("data", [])]
+    if "layout" in figure:
+        compacted["layout"] = _compact(figure["layout"], False)
+    return compacted
+
+
+def expand_strings(values):
+    """A trace's string array as a list, whether compact_figure stored it as a lookup table or not."""
+    if isinstance(values, dict) and "_lookup" in values:
+        return [values["_lookup"][i] for i in values["_index"]]
+    return list(values)
@@ -0,0 +1,242 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from geopy.geocoders import Nominatim
+from staging import STAGING_DIR
+
+
+# Persistent geocode cache, so an address is only sent to Nominatim once. Misses
+# (no result) are cached too, but for a shorter time, since OSM data gets fixed.
+GEOCODE_CACHE_PATH = os.path.join(STAGING_DIR, 'geocode_cache.sqlite')
+GEOCODE_TTL_DAYS = 180
+GEOCODE_MISS_TTL_DAYS = 14
+
+# Optional offline address points, e.g. a DAWA "adgangsadresser" CSV export. When the
+# file exists, addresses are looked up there first and Nominatim is only used for misses.
+ADDRESS_INDEX_PATH = os.path.join('data', 'adresser.csv')
+ADDRESS_INDEX_COLUMNS = {
+    "street": ["vejnavn", "street", "adresseringsvejnavn"],
+    "number": ["husnr", "housenumber", "house_number"],
+    "postcode": ["postnr", "postcode"],
+    "town": ["postnrnavn", "city", "town"],
+    "lat": ["wgs84koordinat_bredde", "lat", "latitude"],
+    "lon": ["wgs84koordinat_længde", "lon", "lng", "longitude"],
+}
+
+_lock = threading.Lock()
+_address_index = {}  # The loaded AddressIndexGeocoder, reused until the CSV changes
+
+
+def normalise_address(address):
+    """Lower-cased address with punctuation and repeated spaces removed - the cache key."""
+    s = re.sub(r'[^\w\s]', ' ', str(address).lower())
+    return re.sub(r'\s+', ' ', s).strip()
+
+
+def _normalise_series(values):
+    """normalise_address for a whole column, computed once per distinct value."""
+    values = values.fillna("").astype(str)
+    return values.map({v: normalise_address(v) for v in values.unique()})
+
+
+class GeocodeCache:
+    def __init__(self, path=GEOCODE_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, query TEXT, lat REAL, lon REAL, source TEXT, fetched_at REAL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """A connection that commits when the block succeeds and is always closed."""
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def get(self, query):
+        """
+        Returns (lat, lon) for a cached hit, None for a cached miss and raises KeyError
+        if the address isn't cached or the entry has expired.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT lat, lon, fetched_at FROM geocode WHERE key = ?",
+                              (normalise_address(query),)).fetchone()
+        if row is None:
+            raise KeyError(query)
+        lat, lon, fetched_at = row
+        ttl = GEOCODE_TTL_DAYS if lat is not None else GEOCODE_MISS_TTL_DAYS
+        if time.time() - fetched_at > ttl * 86400:
+            raise KeyError(query)
+        return None if lat is None else (lat, lon)
+
+    def put(self, query, point, source):
+        lat, lon = point if point else (None, None)
+        with _lock, self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)",
+                        (normalise_address(query), query, lat, lon, source, time.time()))
+
+
+class Geocoder:
+    """
+    Geocoder interface: geocode(query) returns (lat, lon) or None.
+    Offline geocoders set cached = False - their answers are cheap, so they aren't
+    written to the geocode cache and are always asked before it.
+    """
+    name = "geocoder"
+    cached = True
+
+    def geocode(self, query):
+        raise NotImplementedError
+
+    def geocode_batch(self, queries):
+        return {query: self.geocode(query) for query in queries}
+
+
+def split_address(query):
+    """'Biografgade 1A, 8900 Randers C, Denmark' -> ('biografgade', '1a', ['8900 randers c', 'denmark'])."""
+    parts = [normalise_address(p) for p in str(query).split(',')]
+    m = re.match(r'^(.*?)\s*(\d+)\s*([a-z]?)\b', parts[0]) if parts else None
+    if not m or not m.group(1):
+        return None, None, parts[1:]
+    return m.group(1), m.group(2) + m.group(3), parts[1:]
+
+
+class AddressIndexGeocoder(Geocoder):
+    """Offline lookup in a local address-point CSV, indexed by street + house number."""
+    name = "address_index"
+    cached = False
+
+    def __init__(self, path=ADDRESS_INDEX_PATH):
+        header = pd.read_csv(path, nrows=0).columns
+        cols = {}
+        for field, candidates in ADDRESS_INDEX_COLUMNS.items():
+            cols[field] = next((c for c in header if c.lower() in candidates), None)
+        if not all(cols[f] for f in ("street", "number", "lat", "lon")):
+            raise ValueError(f"{path} needs street, house number and lat/lon columns, found {list(header)}")
+
+        df = pd.read_csv(path, usecols=[c for c in cols.values() if c], dtype=str)
+        df = df.rename(columns={c: f for f, c in cols.items() if c})
+        df["lat"] = pd.to_numeric(df["lat"], errors='coerce')
+        df["lon"] = pd.to_numeric(df["lon"], errors='coerce')
+        df = df.dropna(subset=["street", "number", "lat", "lon"])
+
+        # (street, number) -> [(postcode, town, lat, lon)], since the same street
+        # name and number exists in many towns
+        self._index = {}
+        blank = pd.Series("", index=df.index)
+        keys = _normalise_series(df["street"]) + "|" + _normalise_series(df["number"]).str.replace(' ', '')
+        places = zip(df.get("postcode", blank).fillna(""), _normalise_series(df.get("town", blank)),
+                     df["lat"], df["lon"])
+        for key, place in zip(keys, places):
+            self._index.setdefault(key, []).append(place)
+        print(f"Address index loaded: {len(df)} addresses from {path}")
+
+    def geocode(self, query):
+        street, number, rest = split_address(query)
+        candidates = self._index.get(f"{street}|{number}") if street else None
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            # Use the postcode/town in the query to pick the right one
+            hints = [h for h in rest if h]
+            candidates = [c for c in candidates
+                          if any((c[0] and c[0] in h) or (c[1] and (c[1] in h or h in c[1])) for h in hints)]
+            if len(candidates) != 1:
+                return None
+        return (candidates[0][2], candidates[0][3])
+
+
+class NominatimGeocoder(Geocoder):
+    """Nominatim (OpenStreetMap). Rate limited to one request per MIN_INTERVAL seconds."""
+    name = "nominatim"
+    MIN_INTERVAL = 1.1
+
+    def __init__(self, user_agent="randers_energy_map_final"):
+        self._geolocator = Nominatim(user_agent=user_agent)
+        self._last_call = 0.0
+
+    def geocode(self, query):
+        wait = self._last_call + self.MIN_INTERVAL - time.time()
+        if wait > 0:
+            time.sleep(wait)  # Wait to respect geocoder terms
+        try:
+            location = self._geolocator.geocode(query)
+        finally:
+            self._last_call = time.time()
+        return (location.latitude, location.longitude) if location else None
+
+
+def default_geocoders():
+    """The offline address index (if there is one in data/) followed by Nominatim."""
+    geocoders = []
+    if os.path.exists(ADDRESS_INDEX_PATH):
+        st = os.stat(ADDRESS_INDEX_PATH)
+        signature = (st.st_mtime_ns, st.st_size)
+        with _lock:
+            if _address_index.get("signature") != signature:
+                try:
+                    _address_index.update(signature=signature, geocoder=AddressIndexGeocoder(ADDRESS_INDEX_PATH))
+                except Exception as e:
+                    print(f"Address index not used: {e}")
+                    _address_index.update(signature=signature, geocoder=None)
+            if _address_index["geocoder"]:
+                geocoders.append(_address_index["geocoder"])
+    geocoders.append(NominatimGeocoder())
+    return geocoders
+
+
+def geocode_addresses(queries, geocoders=None, cache=None, progress=None):
+    """
+    Geocodes each distinct query once. Offline geocoders are asked first for the
+    whole batch, then the persistent cache, then the online geocoders in order.
+    Returns {query: (lat, lon) or None}. Queries that fail with an error are left
+    out of the cache, so they are retried on the next run.
+    """
+    geocoders = default_geocoders() if geocoders is None else geocoders
+    cache = cache or GeocodeCache()
+    todo = list(dict.fromkeys(queries))
+    results = {}
+
+    for geocoder in [g for g in geocoders if not g.cached]:
+        found = {q: p for q, p in geocoder.geocode_batch(todo).items() if p}
+        print(f"Geocoding: {len(found)} of {len(todo)} addresses found in {geocoder.name}")
+        results.update(found)
+        todo = [q for q in todo if q not in found]
+
+    uncached = []
+    for query in todo:
+        try:
+            results[query] = cache.get(query)
+        except KeyError:
+            uncached.append(query)
+    print(f"Geocoding: {len(todo) - len(uncached)} of {len(todo)} addresses cached, {len(uncached)} to look up")
+
+    online = [g for g in geocoders if g.cached]
+    for i, query in enumerate(uncached):
+        if progress:
+            progress("Geokoder adresser", i, len(uncached))
+        results[query], failed = None, False
+        for geocoder in online:
+            try:
+                results[query] = geocoder.geocode(query)
+            except Exception as ge_err:
+                print(f"Geocoding failed for {query} ({geocoder.name}): {ge_err}")
+                failed = True
+                continue
+            if results[query]:
+                cache.put(query, results[query], geocoder.name)
+                break
+        else:
+            if online and not failed:
+                cache.put(query, None, online[-1].name)
+    return results
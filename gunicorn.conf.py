@@ -0,0 +1,22 @@
+import os
+
+
+# gunicorn -c gunicorn.conf.py wsgi:server
+#
+# The app is imported (preload_app), and its data loaded (when_ready), in the master
+# before the workers are forked. Each worker then serves requests from a thread pool.
+# A Sync runs in the worker that received it; the other workers pick up the new
+# data through data_store's generation file.
+bind = f"{os.environ.get('KL_HOST', '0.0.0.0')}:{os.environ.get('KL_PORT', '8050')}"
+workers = int(os.environ.get("KL_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("KL_THREADS", "8"))
+timeout = int(os.environ.get("KL_TIMEOUT", "120"))
+graceful_timeout = 30
+preload_app = True
+
+
+def when_ready(server):
+    from wsgi import warm_up
+
+    warm_up()
@@ -0,0 +1,58 @@
+import re
+from collections import defaultdict
+
+
+def normalise_name(name):
+    """Lower-cased name with punctuation and repeated spaces removed."""
+    if name is None:
+        return ""
+    s = re.sub(r'[^\w\s]', ' ', str(name).lower())
+    s = re.sub(r'\s+', ' ', s).strip()
+    return "" if s == "nan" else s
+
+
+def _trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class NameIndex:
+    """
+    Trigram inverted index over a list of names. search() finds the names that
+    contain a query (the same as a case-insensitive str.contains, but without
+    scanning every name), similar() finds near misses for reporting.
+    Results are (position in the original list, score) pairs, best first.
+    """
+
+    def __init__(self, names):
+        self.names = [normalise_name(n) for n in names]
+        self._postings = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for gram in _trigrams(name):
+                self._postings[gram].add(i)
+
+    def search(self, query, limit=5):
+        """Names containing the query. Score = share of the name the query covers (1.0 = exact)."""
+        q = normalise_name(query)
+        if not q:
+            return []
+        grams = _trigrams(q)
+        if grams:
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        else:
+            candidates = range(len(self.names))  # Too short for trigrams
+        hits = [(i, len(q) / len(self.names[i])) for i in candidates if q in self.names[i]]
+        return sorted(hits, key=lambda h: (-h[1], h[0]))[:limit]
+
+    def similar(self, query, limit=3, min_score=0.3):
+        """Names sharing the most trigrams with the query (Dice coefficient)."""
+        grams = _trigrams(normalise_name(query))
+        if not grams:
+            return []
+        shared = defaultdict(int)
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                shared[i] += 1
+        scored = [(i, 2 * n / (len(grams) + len(_trigrams(self.names[i])))) for i, n in shared.items()]
+        scored = [h for h in scored if h[1] >= min_score]
+        return sorted(scored, key=lambda h: (-h[1], h[0]))[:limit]
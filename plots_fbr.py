@@ -1,95 +1,87 @@
 import pandas as pd
 import numpy as np
 import plotly.express as px
-import json
 import os
 import traceback
 import plotly.graph_objects as go
 from data_processing_fbr import *
+from data_store import get_store
 from plotly.subplots import make_subplots
 
 
 ## Dashboard 1
-def create_frb_maintenance_budget(is_dark_mode=False):
-    try:
-        with open('frb_processed.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)["maintenance"]
-
-        df = pd.DataFrame(data)
-        if df.empty:
-            return go.Figure().add_annotation(text="Ingen data fundet. Kør Sync.", showarrow=False)
-
-        # Tjek om 'Category' findes, ellers brug 'Condition' som fallback til farve
-        color_col = "Category" if "Category" in df.columns else "Condition"
+def create_frb_maintenance_budget(is_dark_mode=False, buildings=None):
+    df = select_frb_rows(get_store().get("frederiksberg", "maintenance"), buildings)
+    if df.empty:
+        return go.Figure().add_annotation(text="Ingen data fundet. Kør Sync.", showarrow=False)
 
-        # Calculate total budget
-        total_budget = df['Cost'].sum()
+    # Tjek om 'Category' findes, ellers brug 'Condition' som fallback til farve
+    color_col = "Category" if "Category" in df.columns else "Condition"
 
-        # Calculate yearly totals for cumulative line
-        yearly_totals = df.groupby('Year')['Cost'].sum().sort_index()
-        cumulative = yearly_totals.cumsum()
+    # Calculate total budget
+    total_budget = df['Cost'].sum()
 
-        fig = px.bar(
-            df, x="Year", y="Cost", color=color_col,
-            title="Vedligeholdelsesplan (10 år)",
-            labels={"Cost": "Budget (DKK)", "Year": "År", "Category": "Område"},
-            template="plotly_dark" if is_dark_mode else "plotly_white",
-            barmode="stack"
-        )
+    # Calculate yearly totals for cumulative line
+    yearly_totals = df.groupby('Year')['Cost'].sum().sort_index()
+    cumulative = yearly_totals.cumsum()
 
-        # Remove gap lines between stacked segments
-        fig.update_traces(marker_line_width=0, selector=dict(type="bar"))
+    fig = px.bar(
+        df, x="Year", y="Cost", color=color_col,
+        title="Vedligeholdelsesplan (10 år)",
+        labels={"Cost": "Budget (DKK)", "Year": "År", "Category": "Område"},
+        template="plotly_dark" if is_dark_mode else "plotly_white",
+        barmode="stack"
+    )
 
-        # Add cumulative line
-        fig.add_trace(go.Scatter(
-            x=cumulative.index,
-            y=cumulative.values,
-            mode='lines+markers',
-            name='Kumulativ',
-            line=dict(color='#3b82f6', width=3, dash='dot'),
-            marker=dict(size=8),
-            yaxis='y2'
-        ))
+    # Remove gap lines between stacked segments
+    fig.update_traces(marker_line_width=0, selector=dict(type="bar"))
+
+    # Add cumulative line
+    fig.add_trace(go.Scatter(
+        x=cumulative.index,
+        y=cumulative.values,
+        mode='lines+markers',
+        name='Kumulativ',
+        line=dict(color='#3b82f6', width=3, dash='dot'),
+        marker=dict(size=8),
+        yaxis='y2'
+    ))
 
-        fig.update_xaxes(type='category', categoryorder='category ascending')
+    fig.update_xaxes(type='category', categoryorder='category ascending')
 
-        # Format y-axis and add secondary axis for cumulative
-        fig.update_layout(
-            yaxis=dict(
-                title="Årligt Budget (DKK)",
-                tickformat=",.0f",
-                ticksuffix=" DKK"
-            ),
-            yaxis2=dict(
-                title="Kumulativ (DKK)",
-                overlaying='y',
-                side='right',
-                tickformat=",.0f",
-                showgrid=False
-            ),
-            legend=dict(orientation="h", y=-0.15, x=0.5, xanchor="center"),
-            margin=dict(t=80, b=80),
-            # Add total budget annotation
-            annotations=[
-                dict(
-                    text=f"Total: {total_budget:,.0f} DKK",
-                    xref="paper", yref="paper",
-                    x=0.5, y=1.06,
-                    showarrow=False,
-                    font=dict(size=14, color="#10b981"),
-                    xanchor="center"
-                )
-            ]
-        )
-        return fig
-    except Exception as e:
-        return go.Figure().add_annotation(text=f"Fejl i D1: {str(e)}", showarrow=False)
+    # Format y-axis and add secondary axis for cumulative
+    fig.update_layout(
+        yaxis=dict(
+            title="Årligt Budget (DKK)",
+            tickformat=",.0f",
+            ticksuffix=" DKK"
+        ),
+        yaxis2=dict(
+            title="Kumulativ (DKK)",
+            overlaying='y',
+            side='right',
+            tickformat=",.0f",
+            showgrid=False
+        ),
+        legend=dict(orientation="h", y=-0.15, x=0.5, xanchor="center"),
+        margin=dict(t=80, b=80),
+        # Add total budget annotation
+        annotations=[
+            dict(
+                text=f"Total: {total_budget:,.0f} DKK",
+                xref="paper", yref="paper",
+                x=0.5, y=1.06,
+                showarrow=False,
+                font=dict(size=14, color="#10b981"),
+                xanchor="center"
+            )
+        ]
+    )
+    return fig
 
 ## Dashboard 2
-def create_frb_project_scatter(is_dark_mode=False):
-    with open('frb_processed.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)["projects"]
-    df = pd.DataFrame(data)
+def create_frb_project_scatter(is_dark_mode=False, buildings=None):
+    df = select_frb_rows(get_store().get("frederiksberg", "projects"), buildings)
 
     if df.empty:
         return go.Figure().add_annotation(text="Ingen projektdata fundet", showarrow=False)
@@ -149,13 +141,10 @@ def create_frb_project_scatter(is_dark_mode=False):
 
 ## Dashboard 3
 
-def create_frb_property_characteristics(is_dark_mode=False):
+def create_frb_property_characteristics(is_dark_mode=False, buildings=None):
     
 
-    with open('frb_processed.json', 'r', encoding='utf-8') as f:
-        data = json.load(f).get("compliance", [])
-
-    df = pd.DataFrame(data)
+    df = select_frb_rows(get_store().get("frederiksberg", "compliance"), buildings)
     if df.empty:
         return go.Figure().add_annotation(text="Ingen data fundet. Kør Sync.", showarrow=False)
 
@@ -281,18 +270,15 @@ def create_frb_property_characteristics(is_dark_mode=False):
 
 ### Dashboard 7
 
-def create_frb_risk_heatmap(is_dark_mode=False):
-    if not os.path.exists('frb_processed.json'):
-        return go.Figure().add_annotation(text="JSON-fil mangler. Tryk på Sync.", showarrow=False)
-
-    with open('frb_processed.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)["maintenance"]
+def create_frb_risk_heatmap(is_dark_mode=False, buildings=None):
+    if not get_store().get("frederiksberg", "buildings"):
+        return go.Figure().add_annotation(text="Ingen behandlede data. Tryk på Sync.", showarrow=False)
 
-    df = pd.DataFrame(data)
+    df = select_frb_rows(get_store().get("frederiksberg", "maintenance"), buildings)
 
     # CRITICAL: Prevent the 'Expected one of []' error
     if df.empty:
-        return go.Figure().add_annotation(text="Ingen data fundet i JSON.<br>Tjek om Excel-formatet er korrekt.", showarrow=False)
+        return go.Figure().add_annotation(text="Ingen data fundet.<br>Tjek om Excel-formatet er korrekt.", showarrow=False)
 
     # Pivot the data
     pivot = df.pivot_table(index="Condition", columns="Year", values="Cost", aggfunc='sum').fillna(0)
@@ -366,12 +352,9 @@ def create_frb_risk_heatmap(is_dark_mode=False):
 
 
 ## Dashboard 8
-def create_frb_roi_chart(is_dark_mode=False):
-    # Load the JSON we processed earlier
-    with open('frb_processed.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)["projects"]
-
-    df = pd.DataFrame(data)
+def create_frb_roi_chart(is_dark_mode=False, buildings=None):
+    # Load the rows we processed earlier, for the selected buildings
+    df = select_frb_rows(get_store().get("frederiksberg", "projects"), buildings)
 
     if df.empty:
         return go.Figure().add_annotation(text="Ingen projektdata fundet", showarrow=False)
@@ -384,7 +367,7 @@ def create_frb_roi_chart(is_dark_mode=False):
     quick_wins = df[(df['TBT'] <= 10) & (df['CO2'] >= avg_co2)]
     num_quick_wins = len(quick_wins)
 
-    # We match the names from your JSON: 'TBT', 'CO2', 'DDK'
+    # We match the names from the processed data: 'TBT', 'CO2', 'DDK'
     fig = px.scatter(
         df,
         x="TBT",
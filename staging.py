@@ -0,0 +1,421 @@
+import os
+import glob
+import re
+import json
+import hashlib
+import zipfile
+import posixpath
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Columnar staging area written by the Sync button. Every sheet of every source
+# workbook is stored as a typed Parquet cell table, so page renders read Parquet
+# instead of parsing Excel. manifest.json records the hash, mtime and size of each
+# source file, so stale tables are never served.
+#
+# The tables are not handed to the builders as typed, zero-copy DataFrames: a read
+# decodes the cells back to Python values and runs them through the same TextParser
+# call as pd.read_excel (see data_loader._cells_to_frame). That keeps header,
+# skiprows and dtype inference exactly as with the Excel files, at the cost of
+# per-cell Python work on each first read - the cost of XML parsing is what is saved.
+# Processed outputs (Arrow files written by Sync) are the ones that are memory-mapped.
+STAGING_DIR = os.path.join('data', '_staged')
+MANIFEST_NAME = 'manifest.json'
+
+_manifest_cache = {}
+_lock = threading.RLock()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _manifest_path():
+    return os.path.join(STAGING_DIR, MANIFEST_NAME)
+
+
+def load_manifest():
+    """Reads manifest.json (cached until the file changes). Returns {} if there is none."""
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return {"sources": {}}
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _manifest_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    with _lock:
+        _manifest_cache[path] = (signature, manifest)
+    return manifest
+
+
+def write_json_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def write_text_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_table_atomic(path, rows, schema=None, metadata=None):
+    """
+    Writes rows (a list of dicts or a pyarrow Table) as an uncompressed Arrow IPC
+    file, which readers can memory-map (see data_loader.read_table_cached).
+    metadata values are stored as JSON in the schema metadata.
+    """
+    table = rows if isinstance(rows, pa.Table) else pa.Table.from_pylist(rows, schema=schema)
+    if metadata:
+        table = table.replace_schema_metadata({k: json.dumps(v, ensure_ascii=False) for k, v in metadata.items()})
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _is_fresh(entry, path):
+    """True if the source file on disk is still the one the staged tables came from."""
+    if not entry or not os.path.exists(path):
+        return False
+    st = os.stat(path)
+    if entry["size"] != st.st_size:
+        return False
+    if entry["mtime_ns"] == st.st_mtime_ns:
+        return True
+    # Same size but touched (e.g. copied or checked out again) - compare content
+    return entry["sha256"] == file_sha256(path)
+
+
+## Per-sheet content hashes
+# An .xlsx file is a zip with one XML part per sheet, so a sheet's content can be
+# hashed without parsing the workbook. Text cells only hold an index into the shared
+# strings table, so the strings a sheet references are hashed along with it, and
+# styles.xml (number/date formats) is part of every sheet's hash.
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_SHARED_STRING_CELL = re.compile(rb'<c\b[^>]*?\bt="s"[^>]*>\s*<v>(\d+)</v>')
+_SHARED_STRING_ITEM = re.compile(rb'<si>.*?</si>|<si/>', re.DOTALL)
+
+_sheet_hash_cache = {}
+
+
+def sheet_hashes(path):
+    """
+    {sheet name: content hash} in workbook order. Only the sheets whose cells changed
+    get a new hash. Files that aren't a readable .xlsx fall back to the file hash.
+    """
+    st = os.stat(path)
+    signature = (_source_key(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        if signature in _sheet_hash_cache:
+            return dict(_sheet_hash_cache[signature])
+
+    try:
+        with zipfile.ZipFile(path) as zf:
+            names = set(zf.namelist())
+            workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+            rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+            targets = {r.get("Id"): r.get("Target") for r in rels.iter(f"{_NS_PKG_REL}Relationship")}
+            strings = _SHARED_STRING_ITEM.findall(zf.read("xl/sharedStrings.xml")) if "xl/sharedStrings.xml" in names else []
+            styles = hashlib.sha1(zf.read("xl/styles.xml")).digest() if "xl/styles.xml" in names else b""
+
+            hashes = {}
+            for sheet in workbook.iter(f"{_NS_MAIN}sheet"):
+                target = targets[sheet.get(f"{_NS_REL}id")]
+                part = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+                xml = zf.read(part)
+                h = hashlib.sha1(styles)
+                h.update(xml)
+                for idx in _SHARED_STRING_CELL.findall(xml):
+                    i = int(idx)
+                    h.update(strings[i] if i < len(strings) else idx)
+                hashes[sheet.get("name")] = h.hexdigest()
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        print(f"Could not hash sheets of {os.path.basename(path)} ({e}), using the file hash")
+        digest = file_sha256(path)
+        hashes = {"*": digest}
+
+    with _lock:
+        _sheet_hash_cache[signature] = hashes
+    return dict(hashes)
+
+
+def sheets_hash(path, sheets):
+    """One hash for a set of sheets in a workbook - changes if any of them changes."""
+    hashes = sheet_hashes(path)
+    h = hashlib.sha1()
+    for s in sheets:
+        h.update(f"{s}={hashes.get(s, hashes.get('*', ''))};".encode('utf-8'))
+    return h.hexdigest()
+
+
+## Sync state
+# Results of the previous Sync run, keyed by the hash of the inputs they came from,
+# so unchanged sheets/files can be merged in instead of being extracted again. The
+# state is saved with the version of the extraction code that produced it; a state
+# from another version counts as no state, so everything is extracted again.
+
+def load_sync_state(name, version):
+    path = os.path.join(STAGING_DIR, f"sync_{name}.json")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable sync state {path}: {e}")
+        return {}
+    if not isinstance(saved, dict) or saved.get("version") != version:
+        print(f"Sync state {name} is from another extractor version, extracting everything again")
+        return {}
+    return saved.get("state", {})
+
+
+def save_sync_state(name, state, version):
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    write_json_atomic(os.path.join(STAGING_DIR, f"sync_{name}.json"), {"version": version, "state": state})
+
+
+## Derived data
+# Small lookup tables computed from one source file (e.g. an address index), saved
+# with the size and mtime of the file they came from so they are only reused for
+# that exact version of it.
+
+def _derived_path(name, path):
+    return os.path.join(STAGING_DIR, f"{name}_{hashlib.sha1(_source_key(path).encode('utf-8')).hexdigest()[:12]}.json")
+
+
+def load_derived(name, path):
+    """The saved data for this version of the source file, or None."""
+    derived = _derived_path(name, path)
+    if not os.path.exists(derived):
+        return None
+    try:
+        with open(derived, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    st = os.stat(path)
+    if saved.get("mtime_ns") != st.st_mtime_ns or saved.get("size") != st.st_size:
+        return None
+    return saved["data"]
+
+
+def save_derived(name, path, data):
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    st = os.stat(path)
+    write_json_atomic(_derived_path(name, path), {
+        "source": path, "mtime_ns": st.st_mtime_ns, "size": st.st_size, "data": data
+    })
+
+
+## Cell tables
+# A sheet is a list of rows of cell values (str, int/float, bool, datetime, NaN for
+# error cells, "" for blanks). Each sheet column is split into one typed Arrow column
+# per value kind, so the table stays typed even where headers and numbers share a column.
+
+def _cell_kind(v):
+    if v == "" or v is None:
+        return None
+    if isinstance(v, bool):
+        return "b"
+    if isinstance(v, (int, float)):
+        return "n"
+    if isinstance(v, datetime):
+        return "t"
+    return "s"
+
+
+def cells_to_table(data):
+    ncols = len(data[0]) if data else 0
+    arrays, names = [], []
+    for j in range(ncols):
+        column = [row[j] for row in data]
+        kinds = [_cell_kind(v) for v in column]
+        for kind, pa_type in (("s", pa.string()), ("n", pa.float64()), ("b", pa.bool_()), ("t", pa.timestamp('us'))):
+            if kind not in kinds:
+                continue
+            if kind == "s":
+                values = [str(v) if k == "s" else None for v, k in zip(column, kinds)]
+            else:
+                values = [v if k == kind else None for v, k in zip(column, kinds)]
+            arrays.append(pa.array(values, type=pa_type))
+            names.append(f"{j}:{kind}")
+    table = pa.Table.from_arrays(arrays, names=names) if arrays else pa.table({})
+    meta = {b"kl_nrows": str(len(data)).encode(), b"kl_ncols": str(ncols).encode()}
+    return table.replace_schema_metadata(meta)
+
+
+def _decode_column(table, j, nrows):
+    target = [""] * nrows
+    for name in table.column_names:
+        col, kind = name.split(":")
+        if int(col) != j:
+            continue
+        for i, v in enumerate(table.column(name).to_pylist()):
+            if v is None:
+                continue
+            if kind == "n" and v == v and v.is_integer():
+                v = int(v)  # Excel stores every number as float - same as pandas' reader
+            target[i] = v
+    return target
+
+
+def table_to_cells(table):
+    """Cell table -> list of rows of Python values, as _stream_cells in data_loader returns them."""
+    meta = table.schema.metadata or {}
+    nrows = int(meta.get(b"kl_nrows", 0))
+    ncols = int(meta.get(b"kl_ncols", 0))
+    columns = [_decode_column(table, j, nrows) for j in range(ncols)]
+    return [list(row) for row in zip(*columns)] if ncols else [[] for _ in range(nrows)]
+
+
+## Staging
+
+def stage_workbook(path, read_cells, force=False):
+    """
+    Converts the sheets of one workbook to Parquet cell tables. read_cells(path, sheets)
+    must return {sheet: cells}. Only sheets whose content hash changed since the last
+    run are re-read; the rest keep their existing tables.
+    Returns the number of sheets that were (re)staged.
+    """
+    key = _source_key(path)
+    entry = load_manifest()["sources"].get(key)
+    if not force and _is_fresh(entry, path) and all(
+            os.path.exists(os.path.join(STAGING_DIR, f)) for f in entry["sheets"].values()):
+        return 0
+
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    st = os.stat(path)
+    digest = file_sha256(path)
+    prefix = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    old_sheets = (entry or {}).get("sheets", {})
+    old_hashes = (entry or {}).get("sheet_hashes", {})
+
+    hashes = sheet_hashes(path)
+    if "*" in hashes:
+        # Not hashable per sheet - restage the whole workbook
+        cells = read_cells(path, None)
+        hashes = {s: digest for s in cells}
+        changed = list(cells)
+    else:
+        changed = [
+            s for s in hashes
+            if force or old_hashes.get(s) != hashes[s] or s not in old_sheets
+            or not os.path.exists(os.path.join(STAGING_DIR, old_sheets[s]))
+        ]
+        cells = read_cells(path, changed) if changed else {}
+
+    sheets = {s: old_sheets.get(s) for s in hashes}
+    for sheet, data in cells.items():
+        file_name = f"{prefix}_{hashlib.sha1(sheet.encode('utf-8')).hexdigest()[:10]}.parquet"
+        tmp = os.path.join(STAGING_DIR, f"{file_name}.{os.getpid()}.tmp")
+        pq.write_table(cells_to_table(data), tmp, compression='snappy')
+        os.replace(tmp, os.path.join(STAGING_DIR, file_name))
+        sheets[sheet] = file_name
+
+    for sheet, file_name in old_sheets.items():
+        if sheet not in sheets and file_name not in sheets.values():
+            try:
+                os.remove(os.path.join(STAGING_DIR, file_name))
+            except OSError:
+                pass
+
+    with _lock:
+        manifest = load_manifest()
+        manifest["sources"][key] = {
+            "path": path,
+            "sha256": digest,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "sheets": sheets,
+            "sheet_hashes": hashes,
+            "staged_at": datetime.now().isoformat(timespec='seconds')
+        }
+        write_json_atomic(_manifest_path(), manifest)
+    print(f"Staged {os.path.basename(path)}: {len(changed)} of {len(sheets)} sheets changed")
+    return len(changed)
+
+
+def load_staged_cells(path, sheets):
+    """
+    Returns {sheet: cells} read from the staging area, or None if the workbook isn't
+    staged or has changed on disk since it was staged.
+    """
+    entry = load_manifest()["sources"].get(_source_key(path))
+    if not _is_fresh(entry, path) or any(s not in entry["sheets"] for s in sheets):
+        return None
+    try:
+        return {
+            s: table_to_cells(pq.read_table(os.path.join(STAGING_DIR, entry["sheets"][s]), memory_map=True))
+            for s in sheets
+        }
+    except (OSError, pa.ArrowException) as e:
+        print(f"Staging read failed for {path}, falling back to Excel: {e}")
+        return None
+
+
+def load_staged_column(path, sheets, column):
+    """
+    Values (blanks removed) of one header-named column across sheets, decoding only
+    that column of each staged table. None if the workbook isn't staged/fresh.
+    """
+    entry = load_manifest()["sources"].get(_source_key(path))
+    if not _is_fresh(entry, path) or any(s not in entry["sheets"] for s in sheets):
+        return None
+    values = []
+    for s in sheets:
+        table = pq.read_table(os.path.join(STAGING_DIR, entry["sheets"][s]), memory_map=True)
+        nrows = int((table.schema.metadata or {}).get(b"kl_nrows", 0))
+        header_cols = [n for n in table.column_names if n.endswith(":s") and table.num_rows and table.column(n)[0].as_py() == column]
+        if not header_cols:
+            continue
+        j = int(header_cols[0].split(":")[0])
+        values.extend(v for v in _decode_column(table, j, nrows)[1:] if v != "")
+    return values
+
+
+def staged_sheet_names(path):
+    entry = load_manifest()["sources"].get(_source_key(path))
+    return list(entry["sheets"]) if _is_fresh(entry, path) else None
+
+
+def source_workbooks(muni_key, mapping):
+    """All workbooks that mapping.json points to for one municipality."""
+    muni_cfg = mapping.get(muni_key, {})
+    folder = muni_cfg.get("folder", "")
+    paths = []
+    for name, cfg in muni_cfg.items():
+        if name == "files":
+            paths.extend(os.path.join(folder, f) for f in cfg.values())
+        elif name == "buildings":
+            # File name patterns, one set of workbooks per building
+            for pattern in cfg.values():
+                paths.extend(sorted(glob.glob(os.path.join(glob.escape(folder), pattern))))
+        elif isinstance(cfg, dict) and "file" in cfg:
+            paths.append(os.path.join(folder, cfg["file"]))
+        elif isinstance(cfg, dict):
+            paths.extend(p for p in cfg.values() if isinstance(p, str) and p.lower().endswith('.xlsx'))
+    return [p for p in paths if p.lower().endswith('.xlsx')]
@@ -0,0 +1,268 @@
+import os
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from data_processing import rearrange_carbon_data, get_faaborg_address_index
+from data_processing_fbr import process_frederiksberg_data
+from data_processing_randers import process_randers_map_data, get_building_characteristics
+from data_loader import stage_workbooks
+from staging import STAGING_DIR, source_workbooks, write_json_atomic
+from figure_cache import clear_figures
+from data_store import refresh_store, get_store, data_version
+
+try:
+    import fcntl
+except ImportError:  # Windows: waitress serves from one process, where _active alone suffices
+    fcntl = None
+
+
+# Sync runs in a small background pool instead of the Dash request thread, since
+# geocoding alone can take minutes. The UI polls get_job() for progress.
+SYNC_WORKERS = 2
+FINISHED_JOBS_KEPT = 20
+
+# Job state is also written to JOBS_DIR, so that under a multi-worker server the
+# progress poll and the cancel button reach a job running in another worker process.
+# A job also holds an flock on JOBS_DIR/<muni>.lock while queued or running, so a
+# second Sync of the same municipality is refused in every worker, not just in the
+# one that started it. The lock goes away with the process if a worker dies mid-sync.
+JOBS_DIR = os.path.join(STAGING_DIR, 'jobs')
+JOB_PUBLISH_SECONDS = 0.5
+
+_executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="sync")
+_jobs = {}
+_active = {}  # muni -> job_id of the sync currently queued or running
+_lock = threading.Lock()
+
+
+class SyncCancelled(Exception):
+    """Raised inside a sync job when the user has cancelled it."""
+
+
+class SyncJob:
+    def __init__(self, muni):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.muni = muni
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.step = "I kø"
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._published = 0.0
+        self._muni_lock = None  # Open lock file holding the cross-worker lock, see _lock_muni
+
+    def progress(self, step, done=0, total=0):
+        """Progress callback handed to the processors. Also the point where cancellation takes effect."""
+        if self._cancel.is_set() or os.path.exists(_job_path(self.job_id, "cancel")):
+            raise SyncCancelled()
+        self.step, self.done, self.total = step, done, total
+        self.publish()
+
+    def publish(self, force=False):
+        """Writes the job state for the other workers, at most every JOB_PUBLISH_SECONDS unless forced."""
+        now = time.monotonic()
+        if not force and now - self._published < JOB_PUBLISH_SECONDS:
+            return
+        self._published = now
+        try:
+            os.makedirs(JOBS_DIR, exist_ok=True)
+            write_json_atomic(_job_path(self.job_id), self.to_dict())
+        except OSError as e:
+            print(f"Sync: job state not written: {e}")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "muni": self.muni,
+            "status": self.status,
+            "step": self.step,
+            "done": self.done,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "elapsed": round((self.finished or time.time()) - self.started, 1),
+        }
+
+
+def _job_path(job_id, kind="json"):
+    return os.path.join(JOBS_DIR, f"{job_id}.{kind}")
+
+
+def _lock_muni(job):
+    """
+    Takes the cross-worker sync lock of job.muni for job. Returns None on success,
+    else the job_id ("" if not yet written) of the job in another worker holding it.
+    """
+    if fcntl is None:
+        return None
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    lock_file = open(os.path.join(JOBS_DIR, f"{job.muni}.lock"), 'a+', encoding='utf-8')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.seek(0)
+        holder = lock_file.read().strip()
+        lock_file.close()
+        return holder
+    lock_file.truncate(0)
+    lock_file.write(job.job_id)
+    lock_file.flush()
+    job._muni_lock = lock_file
+    return None
+
+
+def _unlock_muni(job):
+    if job._muni_lock is not None:
+        job._muni_lock.close()  # Closing releases the flock
+        job._muni_lock = None
+
+
+def _remove_job_files(job_id):
+    for kind in ("json", "cancel"):
+        try:
+            os.remove(_job_path(job_id, kind))
+        except OSError:
+            pass
+
+
+def run_sync(muni, progress):
+    """The actual ETL for one municipality. Returns a short result text."""
+    with open('mapping.json', 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+
+    # Convert the source workbooks to Parquet first, so both the processing below
+    # and later page renders read the staged tables instead of parsing Excel
+    stage_workbooks(source_workbooks(muni, mapping), progress=progress)
+
+    if muni == "randers":
+        timesafe_path = mapping["randers"]["map_data"]["timesafe"]
+        buildings_path = mapping["randers"]["map_data"]["buildings"]
+        n_points = process_randers_map_data(timesafe_path, buildings_path, progress=progress)
+        progress("Bygningskarakteristik")
+        building_cfg = mapping["randers"]["building_data"]
+        get_building_characteristics(os.path.join(mapping["randers"]["folder"], building_cfg["file"]), building_cfg)
+        return f"{n_points} kortpunkter"
+
+    elif muni == "faaborg":
+        excel_path = "data/faaborg&midtfyn/Forbrugsoplysninger FM.xlsx"
+        n_buildings = rearrange_carbon_data(excel_path, progress=progress)
+        progress("Adresseindeks")
+        get_faaborg_address_index(excel_path)
+        return f"{n_buildings} bygninger"
+
+    elif muni == "frederiksberg":
+        n_buildings = process_frederiksberg_data(mapping["frederiksberg"], progress=progress)
+        return f"{n_buildings} bygninger"
+
+    raise ValueError(f"Unknown municipality: {muni}")
+
+
+def _load_written_outputs(muni):
+    """
+    After a cancelled or failed sync: if it already replaced some of muni's outputs,
+    loads them like a finished sync would, so no worker keeps serving a snapshot of
+    files that are gone from disk.
+    """
+    try:
+        if data_version(muni) != get_store().version(muni):
+            refresh_store(muni)
+            clear_figures()
+    except Exception as e:
+        print(f"Sync: {muni} not reloaded: {e}")
+
+
+def _run_job(job):
+    job.status = "running"
+    try:
+        job.progress("Starter")
+        job.result = run_sync(job.muni, job.progress)
+        job.progress("Indlæser data")
+        refresh_store(job.muni)
+        job.status = "done"
+        clear_figures()
+    except SyncCancelled:
+        job.status = "cancelled"
+        print(f"Sync cancelled: {job.muni} ({job.job_id})")
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        print(f"Sync Error: {e}")
+    finally:
+        if job.status != "done":
+            _load_written_outputs(job.muni)
+        job.finished = time.time()
+        job.publish(force=True)
+        with _lock:
+            if _active.get(job.muni) == job.job_id:
+                del _active[job.muni]
+            _unlock_muni(job)
+
+
+def _forget_old_jobs():
+    finished = sorted((j for j in _jobs.values() if j.finished), key=lambda j: j.finished)
+    for job in finished[:-FINISHED_JOBS_KEPT]:
+        del _jobs[job.job_id]
+        _remove_job_files(job.job_id)
+
+
+def submit_sync(muni):
+    """
+    Queues a sync for the municipality. Returns (job_id, created) - if a sync for
+    the same municipality is already queued or running, in this or another worker,
+    that job's id is returned instead (None if it hasn't published its id yet).
+    """
+    with _lock:
+        running = _active.get(muni)
+        if running is not None:
+            return running, False
+        job = SyncJob(muni)
+        holder = _lock_muni(job)
+        if holder is not None:
+            return holder or None, False
+        _forget_old_jobs()
+        _jobs[job.job_id] = job
+        _active[muni] = job.job_id
+    job.publish(force=True)
+    _executor.submit(_run_job, job)
+    return job.job_id, True
+
+
+def _published_job(job_id):
+    """The state another worker wrote for job_id, or None."""
+    if not job_id or not all(c.isalnum() for c in job_id):
+        return None
+    try:
+        with open(_job_path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_job(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+    return job.to_dict() if job else _published_job(job_id)
+
+
+def cancel_job(job_id):
+    """Asks a job to stop. It stops at its next progress report. Returns False for unknown/finished jobs."""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        # Running in another worker: leave a cancel marker for its progress callback
+        state = _published_job(job_id)
+        if state is None or state["status"] not in ("queued", "running"):
+            return False
+        with open(_job_path(job_id, "cancel"), 'w', encoding='utf-8'):
+            pass
+        return True
+    if job.finished:
+        return False
+    job._cancel.set()
+    return True
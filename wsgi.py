@@ -0,0 +1,37 @@
+import os
+from app import app
+from data_store import get_store
+
+
+# Production entry point: app.server for a WSGI server instead of the Werkzeug
+# development server in app.py.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:server    (Linux; pre-fork, see gunicorn.conf.py)
+#   python wsgi.py                              (waitress; also runs on Windows)
+#
+# Settings come from the environment: KL_HOST, KL_PORT, KL_WORKERS (gunicorn only),
+# KL_THREADS, KL_TIMEOUT and KL_PRELOAD.
+server = app.server
+
+HOST = os.environ.get("KL_HOST", "0.0.0.0")
+PORT = int(os.environ.get("KL_PORT", "8050"))
+THREADS = int(os.environ.get("KL_THREADS", "8"))
+TIMEOUT = int(os.environ.get("KL_TIMEOUT", "120"))
+
+def warm_up():
+    """
+    Loads every municipality's data before serving. Under gunicorn this runs once in
+    the master (the when_ready hook in gunicorn.conf.py), so the forked workers start
+    with the data in place and share its memory copy-on-write - the Arrow outputs are
+    memory-mapped and shared through the page cache anyway. Not done on import:
+    Sync's spawned worker processes import this script again as __mp_main__.
+    """
+    if os.environ.get("KL_PRELOAD", "1") == "1":
+        get_store().warm()
+
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    warm_up()
+    serve(server, host=HOST, port=PORT, threads=THREADS, channel_timeout=TIMEOUT)